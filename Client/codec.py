@@ -0,0 +1,346 @@
+# coding: utf-8
+"""
+Frame encoders and decoders. MJPEG frames stand alone, H.264 frames
+(through PyAV/libx264, when installed) depend on the frames before
+them up to the last keyframe, and tile frames only carry the parts
+of the picture that changed. JPEG goes through the backend probed in
+jpeg.py. Keep this file identical in Server/ and Client/.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from threading import Lock
+
+from cv2 import COLOR_BGR2GRAY, INTER_AREA, cvtColor, resize
+from numpy import abs as np_abs
+from numpy import int16, ones, pad, repeat, uint8, zeros
+
+import jpeg
+from protocol import (FLAG_H264, FLAG_KEYFRAME, FLAG_TILES, FRAME_ID_MASK,
+                      TILE, TILES)
+
+try:
+    import av
+
+except ImportError:
+    av = None
+
+CODEC_MASK = FLAG_H264 | FLAG_TILES
+
+
+def scaled(img, scale):
+    if scale == 1.0:
+        return img
+
+    return resize(img, None, fx=scale, fy=scale, interpolation=INTER_AREA)
+
+
+class MjpegEncoder:
+    """
+    Every frame is a standalone JPEG, any encoder thread can take it
+    """
+    intra = True
+    # JPEGs encoded by the camera can be sent as they are.
+    passthrough = True
+
+    def __init__(self, subsampling="420", backend=None):
+        self.subsampling = subsampling
+        self.jpeg = jpeg.backend if backend is None else backend
+
+    def encode(self, img, quality, scale=1.0):
+        """Return (bytes, flags) of one frame."""
+        return self.jpeg.encode(
+            scaled(img, scale), quality, self.subsampling), FLAG_KEYFRAME
+
+
+class H264Encoder:
+    """
+    Software libx264 without B-frames, so every frame comes out as soon
+    as it went in, with a keyframe each gop frames
+    """
+    intra = False
+    passthrough = False
+
+    def __init__(self, framerate=35, gop=None):
+        if av is None:
+            raise RuntimeError("H.264 needs PyAV (pip install av)")
+
+        self.framerate = framerate
+        self.gop = framerate if gop is None else gop
+        self.context = None
+        self.settings = None
+        self.pts = 0
+        # Frame the stream was last opened at.
+        self.opened_at = 0
+
+    def open(self, width, height, quality):
+        context = av.CodecContext.create("libx264", "w")
+        context.width = width
+        context.height = height
+        context.pix_fmt = "yuv420p"
+        context.time_base = Fraction(1, self.framerate)
+        context.framerate = Fraction(self.framerate, 1)
+        context.gop_size = self.gop
+        # JPEG quality 20..95 maps onto CRF 38..19.
+        crf = max(0, min(51, round(43 - quality / 4)))
+        context.options = {
+            "preset": "ultrafast", "tune": "zerolatency", "crf": str(crf)}
+        return context
+
+    def encode(self, img, quality, scale=1.0):
+        """Return (bytes, flags) of one frame."""
+        img = scaled(img, scale)
+        # yuv420p needs even dimensions.
+        height, width = img.shape[0] & ~1, img.shape[1] & ~1
+        settings = (width, height, quality)
+        # Reopening starts the stream over with a keyframe, a new size
+        # needs one right away, a new quality waits for the next one.
+        resized = self.settings is None or settings[:2] != self.settings[:2]
+        keyframe_due = (self.pts - self.opened_at) % self.gop == 0
+
+        if resized or (settings != self.settings and keyframe_due):
+            self.context = self.open(width, height, quality)
+            self.settings = settings
+            self.opened_at = self.pts
+
+        frame = av.VideoFrame.from_ndarray(
+            img[:height, :width], format="bgr24")
+        frame.pts = self.pts
+        self.pts += 1
+
+        packets = self.context.encode(frame)
+        flags = FLAG_H264
+
+        if any(packet.is_keyframe for packet in packets):
+            flags |= FLAG_KEYFRAME
+
+        return b"".join(bytes(packet) for packet in packets), flags
+
+
+class TileEncoder:
+    """
+    Split the picture into a grid and JPEG-encode, in parallel, only
+    the tiles whose downsampled luma moved since the receiver got them,
+    with a full refresh every `refresh` frames or once more than the
+    `fallback` share of the tiles moved
+    """
+    intra = False
+    passthrough = False
+
+    def __init__(self, framerate=35, tile=64, step=4, threshold=6,
+                 refresh=None, fallback=0.5, workers=3, subsampling="420",
+                 backend=None):
+        self.jpeg = jpeg.backend if backend is None else backend
+        self.subsampling = subsampling
+        self.tile = tile
+        # Luma is compared on every step-th pixel of every step-th row.
+        self.step = step
+        self.threshold = threshold
+        self.refresh = 2 * framerate if refresh is None else refresh
+        # Past this share of changed tiles, one picture-sized tile is
+        # smaller than the many tiles with their own JPEG headers.
+        self.fallback = fallback
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.reference = None
+        self.count = 0
+
+    def changed(self, img):
+        """Boolean grid of the tiles that have to be sent."""
+        step = self.step
+        luma = cvtColor(img[::step, ::step], COLOR_BGR2GRAY).astype(int16)
+        cell = self.tile // step
+        rows = -(-luma.shape[0] // cell)
+        cols = -(-luma.shape[1] // cell)
+        luma = pad(luma, (
+            (0, rows * cell - luma.shape[0]),
+            (0, cols * cell - luma.shape[1])))
+
+        if (self.reference is None or self.reference.shape != luma.shape
+                or self.count % self.refresh == 0):
+            changed = ones((rows, cols), dtype=bool)
+
+        else:
+            diff = np_abs(luma - self.reference)
+            changed = diff.reshape(rows, cell, cols, cell).mean(
+                axis=(1, 3)) > self.threshold
+
+            if changed.mean() > self.fallback:
+                changed[:] = True
+
+        if self.reference is None or self.reference.shape != luma.shape:
+            self.reference = luma
+
+        else:
+            # Only what was sent becomes the reference, so slow drifts
+            # still add up until they cross the threshold.
+            mask = repeat(repeat(changed, cell, axis=0), cell, axis=1)
+            self.reference[mask] = luma[mask]
+
+        return changed
+
+    def encode(self, img, quality, scale=1.0):
+        """Return (bytes, flags) of one frame."""
+        img = scaled(img, scale)
+        changed = self.changed(img)
+        full = changed.all()
+        self.count += 1
+        tile = self.tile
+        height, width = img.shape[:2]
+
+        def encode_tile(position):
+            y, x = position[0] * tile, position[1] * tile
+            part = img[y:y + tile, x:x + tile]
+            dat = self.jpeg.encode(part, quality, self.subsampling)
+            h, w = part.shape[:2]
+            return TILE.pack(x, y, w, h, len(dat)) + dat
+
+        if full:
+            # One picture-sized tile spares the JPEG headers of each tile.
+            dat = self.jpeg.encode(img, quality, self.subsampling)
+            records = [TILE.pack(0, 0, width, height, len(dat)) + dat]
+
+        else:
+            records = list(
+                self.pool.map(encode_tile, zip(*changed.nonzero())))
+
+        flags = FLAG_TILES | (FLAG_KEYFRAME if full else 0)
+
+        return TILES.pack(width, height, len(records)) + b"".join(
+            records), flags
+
+
+def create_encoder(name, framerate=35, subsampling="420"):
+    """Encoder by name, `mjpeg`, `h264` or `tiles`."""
+    if name == "h264":
+        return H264Encoder(framerate)
+
+    if name == "tiles":
+        return TileEncoder(framerate, subsampling=subsampling)
+
+    if name != "mjpeg":
+        raise ValueError(f"Unknown codec {name}")
+
+    return MjpegEncoder(subsampling)
+
+
+class MjpegDecoder:
+    intra = True
+    # Only JPEG frames can be decoded at a reduced size.
+    reduces = True
+
+    def __init__(self, backend=None):
+        self.jpeg = jpeg.backend if backend is None else backend
+        self.colorfmt = self.jpeg.colorfmt
+
+    def decode(self, data, frame_id, flags, reduction=1):
+        """Return the colorfmt image of a frame, or None."""
+        return self.jpeg.decode(data, reduction)
+
+
+class H264Decoder:
+    """
+    Decodes frames strictly in order; after a gap it waits
+    for the next keyframe instead of showing a broken picture
+    """
+    intra = False
+    reduces = False
+    colorfmt = "bgr"
+
+    def __init__(self):
+        if av is None:
+            raise RuntimeError("H.264 needs PyAV (pip install av)")
+
+        self.context = av.CodecContext.create("h264", "r")
+        self.lock = Lock()
+        self.last_id = None
+
+    def decode(self, data, frame_id, flags):
+        """Return the colorfmt image of a frame, or None."""
+        with self.lock:
+            keyframe = flags & FLAG_KEYFRAME
+
+            if not keyframe and (
+                    self.last_id is None
+                    or frame_id != (self.last_id + 1) & FRAME_ID_MASK):
+                self.last_id = None
+                return None
+
+            self.last_id = frame_id
+
+            try:
+                frames = self.context.decode(av.Packet(bytes(data)))
+
+            except av.error.FFmpegError as error:
+                logging.warning(error)
+                self.last_id = None
+                return None
+
+            if not frames:
+                return None
+
+            return frames[-1].to_ndarray(format="bgr24")
+
+
+class TileDecoder:
+    """
+    Patch received tiles into a persistent picture, starting from
+    the first full refresh and again from the next one after a gap
+    """
+    intra = False
+    reduces = False
+
+    def __init__(self, backend=None):
+        self.jpeg = jpeg.backend if backend is None else backend
+        self.colorfmt = self.jpeg.colorfmt
+        self.lock = Lock()
+        self.picture = None
+        self.last_id = None
+
+    def decode(self, data, frame_id, flags):
+        """Return the colorfmt image of a frame, or None."""
+        width, height, count = TILES.unpack_from(data)
+
+        with self.lock:
+            keyframe = flags & FLAG_KEYFRAME
+
+            # Only the changed tiles are sent, so after a gap the
+            # picture is patched again from the next full refresh.
+            if not keyframe and (
+                    self.last_id is None
+                    or frame_id != (self.last_id + 1) & FRAME_ID_MASK):
+                self.last_id = None
+                return None
+
+            if self.picture is None or self.picture.shape[:2] != (
+                    height, width):
+                if not keyframe:
+                    self.last_id = None
+                    return None
+
+                self.picture = zeros((height, width, 3), dtype=uint8)
+
+            self.last_id = frame_id
+            offset = TILES.size
+
+            for _ in range(count):
+                x, y, w, h, length = TILE.unpack_from(data, offset)
+                offset += TILE.size
+                part = self.jpeg.decode(data[offset:offset + length])
+                offset += length
+
+                if part is not None:
+                    self.picture[y:y + h, x:x + w] = part
+
+            # The next frame patches the picture while this one is shown.
+            return self.picture.copy()
+
+
+def create_decoder(flags):
+    """Decoder for the codec a frame's flags name."""
+    if flags & FLAG_H264:
+        return H264Decoder()
+
+    if flags & FLAG_TILES:
+        return TileDecoder()
+
+    return MjpegDecoder()
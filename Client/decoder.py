@@ -0,0 +1,206 @@
+# coding: utf-8
+import logging
+from threading import Lock, Thread
+from time import monotonic
+
+from numpy import ascontiguousarray
+
+from codec import CODEC_MASK, create_decoder
+from metrics import Histogram
+from protocol import LAYER_MASK, layer_of
+from udpstream import LatestFrame, superseded
+
+
+class DecodedFrame:
+    """
+    Pixels of one frame, ready to be blitted into a texture
+    """
+    __slots__ = (
+        "frame_id", "size", "pixels", "layer", "reduction", "colorfmt",
+        "stamps")
+
+    def __init__(self, frame_id, size, pixels, layer=0, reduction=1,
+                 colorfmt="bgr", stamps=None):
+        self.frame_id = frame_id
+        self.size = size
+        self.pixels = pixels
+        self.layer = layer
+        self.reduction = reduction
+        # Pixel order, rgb straight from TurboJPEG, bgr from OpenCV.
+        self.colorfmt = colorfmt
+        # (network time, first segment, complete, decode start,
+        # decode end) for the latency of each stage.
+        self.stamps = stamps
+
+
+class DecodePool:
+    """
+    Worker threads decoding the newest received frame,
+    frames overtaken while waiting or decoding are skipped;
+    inter-frame codecs decode every frame in order on one worker
+    and only drop frames once they are decoded
+    """
+
+    def __init__(self, feed, workers=2):
+        self.feed = feed
+        self.workers = workers
+        self.latest = LatestFrame()
+        self.lock = Lock()
+        # Held by the worker taking and decoding an ordered frame.
+        self.ordering = Lock()
+        self.decoders = {}
+        self.last_id = None
+        # JPEG frames are decoded at 1/reduction of their size.
+        self.reduction = 1
+        self.decoded = 0
+        self.copied = 0
+        self.skipped = 0
+        self.failed = 0
+        self.decode_time = Histogram()
+        self.running = False
+
+    def start(self):
+        self.running = True
+
+        for _ in range(self.workers):
+            Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        while self.running:
+            if self.feed.ordered:
+                with self.ordering:
+                    frame = self.step()
+
+            else:
+                frame = self.step()
+
+            if frame is None:
+                self.feed.wait()
+
+    def step(self):
+        """Take and decode one frame, return None if there was none."""
+        # Clear before taking so a frame put in between still wakes us.
+        self.feed.arrived.clear()
+        frame = self.feed.take()
+
+        if frame is None:
+            return None
+
+        if frame.restart:
+            self.restart()
+
+        start = monotonic()
+
+        try:
+            decoded = self.decode(frame)
+
+        except Exception as error:
+            logging.error(error)
+            self.failed += 1
+            decoded = None
+
+        finally:
+            self.feed.release(frame)
+
+        end = monotonic()
+        self.decode_time.observe(end - start)
+        # Smoothed decode time, reported back to the sender.
+        self.feed.decode_time += 0.1 * (
+            end - start - self.feed.decode_time)
+
+        if decoded is not None:
+            decoded.stamps = (
+                self.feed.network_time(frame), frame.arrived,
+                frame.completed, start, end)
+            self.publish(decoded, frame.restart)
+
+        return frame
+
+    def restart(self):
+        """Start over with fresh decoders once the sender restarted."""
+        with self.lock:
+            self.decoders = {}
+            self.last_id = None
+
+    def decoder(self, flags):
+        """Decoder of the codec and simulcast layer of a frame."""
+        # Layers are separate streams to inter-frame decoders.
+        codec = flags & (CODEC_MASK | LAYER_MASK)
+
+        with self.lock:
+            if codec not in self.decoders:
+                self.decoders[codec] = create_decoder(codec)
+
+            return self.decoders[codec]
+
+    def decode(self, frame):
+        """Turn an encoded frame into top-down pixels."""
+        decoder = self.decoder(frame.flags)
+        # OpenCV releases the GIL here, so MJPEG workers decode in
+        # parallel; H.264 decodes one frame at a time, in order.
+        if decoder.reduces:
+            reduction = self.reduction
+            image = decoder.decode(
+                frame.data, frame.frame_id, frame.flags, reduction)
+
+        else:
+            reduction = 1
+            image = decoder.decode(frame.data, frame.frame_id, frame.flags)
+
+        if image is None:
+            if decoder.intra:
+                logging.warning(f"Could not decode frame {frame.frame_id}")
+                self.failed += 1
+
+            else:
+                # Waiting for a keyframe after a lost frame.
+                self.skipped += 1
+
+            return None
+
+        if not image.flags.c_contiguous:
+            image = ascontiguousarray(image)
+            self.copied += image.nbytes
+
+        # The texture takes the decoder's pixel order and is flipped
+        # by its coordinates, so the decoded array is handed over as
+        # it is.
+        return DecodedFrame(
+            frame.frame_id,
+            (image.shape[1], image.shape[0]),
+            image.reshape(-1),
+            layer_of(frame.flags),
+            reduction,
+            decoder.colorfmt)
+
+    def metrics(self):
+        labels = {"stream": self.feed.stream_id}
+        yield "frames_decoded_total", labels, self.decoded
+        yield "frames_decode_failed_total", labels, self.failed
+        yield "frames_skipped_total", labels, self.skipped
+        yield "bytes_copied_total", labels, self.copied
+        yield "decode_seconds", labels, self.decode_time
+        yield "decode_reduction", labels, self.reduction
+
+    def copied_per_frame(self):
+        """Average bytes copied between decode and blit."""
+        return self.copied / max(self.decoded, 1)
+
+    def publish(self, decoded, restart=False):
+        with self.lock:
+            if not restart and superseded(decoded.frame_id, self.last_id):
+                # A newer frame finished decoding first.
+                self.skipped += 1
+                return
+
+            self.last_id = decoded.frame_id
+            self.decoded += 1
+
+        self.latest.put(decoded)
+
+    def take(self):
+        """Return the newest decoded frame or None."""
+        return self.latest.take()
@@ -0,0 +1,115 @@
+# coding: utf-8
+"""
+JPEG backends. OpenCV is always there; libjpeg-turbo through
+PyTurboJPEG, when it loads, decodes straight into the texture's RGB
+order. The backend is probed once at startup. Keep this file
+identical in Server/ and Client/.
+"""
+import logging
+
+from cv2 import (IMREAD_COLOR, IMREAD_REDUCED_COLOR_2, IMREAD_REDUCED_COLOR_4,
+                 IMREAD_REDUCED_COLOR_8, IMWRITE_JPEG_QUALITY, imdecode,
+                 imencode)
+from numpy import frombuffer, uint8
+
+try:
+    from turbojpeg import (TJPF_BGR, TJPF_RGB, TJSAMP_420, TJSAMP_422,
+                           TJSAMP_444, TurboJPEG)
+
+except ImportError:
+    TurboJPEG = None
+
+# JPEG is scaled down while decoding, in the DCT domain, by 1/2, 1/4
+# or 1/8, which costs less than a full decode.
+REDUCTIONS = {
+    1: IMREAD_COLOR,
+    2: IMREAD_REDUCED_COLOR_2,
+    4: IMREAD_REDUCED_COLOR_4,
+    8: IMREAD_REDUCED_COLOR_8,
+}
+
+# cv2.IMWRITE_JPEG_SAMPLING_FACTOR and its values, spelled out as
+# OpenCV before 4.5.5 neither names nor honours them.
+IMWRITE_JPEG_SAMPLING_FACTOR = 7
+CV_SAMPLING = {"420": 0x221111, "422": 0x211111, "444": 0x111111}
+
+
+def reduction_for(size, target):
+    """Largest reduction that keeps size at least as large as target."""
+    return max((
+        reduction for reduction in REDUCTIONS
+        if size[0] // reduction >= target[0]
+        and size[1] // reduction >= target[1]), default=1)
+
+
+class OpenCVJpeg:
+    """
+    OpenCV's libjpeg, decodes to BGR
+    """
+    name = "opencv"
+    # Pixel order of decoded images.
+    colorfmt = "bgr"
+
+    def encode(self, img, quality, subsampling="420"):
+        """JPEG bytes of a BGR image."""
+        return imencode('.jpg', img, [
+            int(IMWRITE_JPEG_QUALITY), quality,
+            IMWRITE_JPEG_SAMPLING_FACTOR, CV_SAMPLING[subsampling]
+        ])[1].tobytes()
+
+    def decode(self, data, reduction=1):
+        """Image at 1/reduction of its size in colorfmt order, or None."""
+        return imdecode(
+            frombuffer(data, dtype=uint8), REDUCTIONS[reduction])
+
+
+class TurboJpeg:
+    """
+    libjpeg-turbo, decodes to RGB so the texture needs no channel swap
+    """
+    name = "turbojpeg"
+    colorfmt = "rgb"
+
+    def __init__(self):
+        if TurboJPEG is None:
+            raise RuntimeError("TurboJPEG needs PyTurboJPEG")
+
+        # Raises when the libturbojpeg shared library is missing.
+        self.tj = TurboJPEG()
+        self.sampling = {
+            "420": TJSAMP_420, "422": TJSAMP_422, "444": TJSAMP_444}
+
+    def encode(self, img, quality, subsampling="420"):
+        """JPEG bytes of a BGR image."""
+        return self.tj.encode(
+            img, quality, TJPF_BGR, self.sampling[subsampling])
+
+    def decode(self, data, reduction=1):
+        """Image at 1/reduction of its size in colorfmt order, or None."""
+        try:
+            return self.tj.decode(
+                data, TJPF_RGB,
+                (1, reduction) if reduction > 1 else None)
+
+        except OSError as error:
+            logging.warning(error)
+            return None
+
+
+BACKENDS = {"opencv": OpenCVJpeg, "turbojpeg": TurboJpeg}
+
+
+def probe(name=None):
+    """JPEG backend by name, or TurboJPEG if it loads and else OpenCV."""
+    if name is not None:
+        return BACKENDS[name]()
+
+    try:
+        return TurboJpeg()
+
+    except (OSError, RuntimeError) as error:
+        logging.info(f"Using OpenCV for JPEG ({error})")
+        return OpenCVJpeg()
+
+
+backend = probe()
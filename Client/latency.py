@@ -0,0 +1,71 @@
+# coding: utf-8
+from collections import deque
+
+# Capture to first segment (with the sender's encode and send queue),
+# first to last segment, waiting for a decoder, decoding, waiting for
+# the next frame the UI draws, uploading the texture, and all of it.
+STAGES = (
+    "network", "reassembly", "queue", "decode", "display", "blit", "total")
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(ordered, point):
+    """Nearest rank percentile of a sorted list."""
+    rank = round(point / 100 * len(ordered))
+    return ordered[min(len(ordered), max(rank, 1)) - 1]
+
+
+class Latency:
+    """
+    Rolling window of the time frames spend in each stage,
+    from the camera to the texture on screen
+    """
+
+    def __init__(self, window=300):
+        self.samples = {stage: deque(maxlen=window) for stage in STAGES}
+
+    def add(self, stamps, shown, blitted):
+        """Note the stages of a frame blitted between shown and blitted."""
+        if stamps is None:
+            return
+
+        network, arrived, completed, decoding, decoded = stamps
+        times = {
+            "reassembly": completed - arrived,
+            "queue": decoding - completed,
+            "decode": decoded - decoding,
+            "display": shown - decoded,
+            "blit": blitted - shown,
+        }
+
+        if network is not None:
+            # Only once the sender's clock is known.
+            times["network"] = network
+            times["total"] = network + blitted - arrived
+
+        for stage, elapsed in times.items():
+            self.samples[stage].append(elapsed)
+
+    def summary(self):
+        """Milliseconds at each percentile of every stage with samples."""
+        result = {}
+
+        for stage, samples in self.samples.items():
+            if samples:
+                ordered = sorted(samples)
+                result[stage] = tuple(
+                    percentile(ordered, point) * 1000
+                    for point in PERCENTILES)
+
+        return result
+
+    def text(self):
+        """Summary as lines of text for an overlay."""
+        header = " ".join(f"p{point:<5}" for point in PERCENTILES)
+        lines = [f"{'ms':<10} {header}"]
+
+        for stage, values in self.summary().items():
+            lines.append(f"{stage:<10} " + " ".join(
+                f"{value:6.1f}" for value in values))
+
+        return "\n".join(lines)
@@ -0,0 +1,209 @@
+# coding: utf-8
+"""
+Counters, gauges and histograms of the sender and the receiver, served
+over HTTP as Prometheus text on /metrics and as JSON on /metrics.json.
+Components keep their plain counters and are only read when scraped.
+"""
+import json
+import logging
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+PREFIX = "udpcamera_"
+# Seconds, for encode and decode times.
+TIME_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.02, 0.04, 0.08, 0.16, 0.32)
+# Bytes, for encoded frames.
+SIZE_BUCKETS = (
+    4_000, 8_000, 16_000, 32_000, 64_000, 128_000, 256_000, 512_000)
+
+
+class Histogram:
+    """
+    Observations counted into buckets by their upper bound
+    """
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.lock = Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def snapshot(self):
+        """Return (cumulative counts per bound, sum, count)."""
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+
+        cumulative = []
+        seen = 0
+
+        for bound, count in zip((*self.buckets, float("inf")), counts):
+            seen += count
+            cumulative.append((bound, seen))
+
+        return cumulative, total, seen
+
+
+def kind(name, value):
+    if isinstance(value, Histogram):
+        return "histogram"
+
+    return "counter" if name.endswith("_total") else "gauge"
+
+
+def format_labels(labels, **extra):
+    pairs = {**labels, **extra}
+
+    if not pairs:
+        return ""
+
+    return "{" + ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\")
+                         .replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in pairs.items()) + "}"
+
+
+def format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+class Registry:
+    """
+    Collectors of every component, each a callable yielding
+    (name, labels, value) with a number or a Histogram as value
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.collectors = []
+
+    def register(self, collector):
+        with self.lock:
+            self.collectors = [*self.collectors, collector]
+
+    def unregister(self, collector):
+        with self.lock:
+            self.collectors = [
+                c for c in self.collectors if c != collector]
+
+    def collect(self):
+        """Samples of every collector grouped by metric name."""
+        families = {}
+
+        for collector in self.collectors:
+            try:
+                samples = list(collector())
+
+            except Exception as error:
+                logging.warning(f"Metrics collector failed: {error}")
+                continue
+
+            for name, labels, value in samples:
+                families.setdefault(PREFIX + name, []).append(
+                    (labels, value))
+
+        return families
+
+    def prometheus(self):
+        """Every metric in the Prometheus text format."""
+        lines = []
+
+        for name, samples in self.collect().items():
+            lines.append(f"# TYPE {name} {kind(name, samples[0][1])}")
+
+            for labels, value in samples:
+                if not isinstance(value, Histogram):
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+                    continue
+
+                cumulative, total, count = value.snapshot()
+
+                for bound, seen in cumulative:
+                    lines.append(
+                        f"{name}_bucket"
+                        f"{format_labels(labels, le=format_bound(bound))}"
+                        f" {seen}")
+
+                lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+    def json(self):
+        """Every metric as a JSON object keyed by name."""
+        result = {}
+
+        for name, samples in self.collect().items():
+            entries = result[name] = []
+
+            for labels, value in samples:
+                if isinstance(value, Histogram):
+                    cumulative, total, count = value.snapshot()
+                    value = {
+                        "buckets": {
+                            format_bound(bound): seen
+                            for bound, seen in cumulative},
+                        "sum": total, "count": count}
+
+                entries.append({"labels": labels, "value": value})
+
+        return json.dumps(result)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        registry = self.server.registry
+
+        if self.path == "/metrics":
+            body = registry.prometheus()
+            content_type = "text/plain; version=0.0.4"
+
+        elif self.path == "/metrics.json":
+            body = registry.json()
+            content_type = "application/json"
+
+        else:
+            self.send_error(404)
+            return
+
+        data = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(registry, port, host="127.0.0.1"):
+    """
+    Serve a registry over HTTP from a daemon thread, return None and
+    go on without metrics when the port is taken.
+    """
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+
+    except OSError as error:
+        logging.warning(f"Metrics not served on port {port}: {error}")
+        return None
+
+    server.daemon_threads = True
+    server.registry = registry
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+# Shared by every component of the process.
+registry = Registry()
@@ -8,26 +8,31 @@ import logging
 import os
 import socket
 from datetime import datetime
-from socket import timeout as TimeoutException
-from struct import unpack
+from math import ceil, sqrt
 from threading import Thread
+from time import monotonic
 
 import requests
-from cv2 import flip, imdecode
 from kivy.app import App
 from kivy.clock import Clock
 from kivy.graphics.texture import Texture
 from kivy.lang.builder import Builder
 from kivy.properties import (BooleanProperty, ColorProperty, ListProperty,
-                             NumericProperty, StringProperty)
+                             NumericProperty, ObjectProperty, StringProperty)
 from kivy.uix.anchorlayout import AnchorLayout
 from kivy.uix.effectwidget import EffectBase
 from kivy.uix.floatlayout import FloatLayout
+from kivy.uix.gridlayout import GridLayout
 from kivy.uix.image import Image
-from numpy import frombuffer, uint8
 from telegram import Bot, ChatAction, ParseMode
 
+import metrics
+from decoder import DecodePool
+from jpeg import reduction_for
+from latency import PERCENTILES, Latency
 from lunar import lunar_phase
+from protocol import LAYERS
+from udpstream import FrameReceiver, join_group
 
 shader = """
 // http://stackoverflow.com/a/21604810/1209937
@@ -176,8 +181,19 @@ Builder.load_string(
                 pos: self.pos
                 radius: [50, ]
 
+<Stream>:
+    Label:
+        text: root.stats
+        opacity: 1 if root.overlay else 0
+        font_name: 'RobotoMono-Regular'
+        font_size: 14
+        size: self.texture_size
+        pos: root.x + 10, root.top - self.height - 10
+        outline_color: 0, 0, 0, 1
+        outline_width: 1
+
 <Picture>:
-    Stream:
+    StreamGrid:
         id: streamer
         fps: 60
 
@@ -303,56 +319,234 @@ class Stream(Image):
     nocache = BooleanProperty(True)
     fps = NumericProperty(60)
     ready = BooleanProperty(False)
+    timeout = NumericProperty(5)
+    feed = ObjectProperty(None)
+    # Latency percentiles of each stage drawn over the picture.
+    overlay = BooleanProperty(False)
+    stats = StringProperty("")
+    # Hold frames back to play them out evenly despite jitter, up to
+    # max_delay seconds, or show each one as soon as it is complete.
+    jitter_buffer = BooleanProperty(False)
+    max_delay = NumericProperty(0.5)
+    decoder = None
+    event = None
+    stats_event = None
+    frame_texture = None
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.MAX_DGRAM = 2 ** 16
-        self.s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.s.bind(("0.0.0.0", 6666))
-        self.s.settimeout(5)
-        self.buffer = b""
-        Thread(target=self.update).start()
+        self.latency = Latency()
+        self.decoder = DecodePool(self.feed, workers=2)
+        self.decoder.start()
+        self.on_fps(self, self.fps)
+        self.on_overlay(self, self.overlay)
+        self.on_jitter_buffer(self, self.jitter_buffer)
 
-    def update(self, dt=None):
+    def on_fps(self, instance, fps):
+        if self.decoder is None:
+            return
 
-        try:
-            seg, addr = self.s.recvfrom(self.MAX_DGRAM)
+        if self.event is not None:
+            self.event.cancel()
 
-            if unpack("B", seg[0:1])[0] in (0, 1):
-                Clock.schedule_once(self.set_image, -1)
-                Clock.schedule_once(self.update, 0)
+        self.event = Clock.schedule_interval(self.set_image, 1 / fps)
 
-            else:
-                self.buffer += seg[1:]
+    def on_jitter_buffer(self, instance, jitter_buffer):
+        if self.decoder is not None:
+            self.feed.set_playout(jitter_buffer, self.max_delay)
 
-        except TimeoutException:
-            self.set_ready_state(False)
-            Thread(target=self.update).start()
+    def on_max_delay(self, instance, max_delay):
+        self.on_jitter_buffer(self, self.jitter_buffer)
 
-        except Exception as error:
-            logging.critical(error)
+    def on_overlay(self, instance, overlay):
+        if self.stats_event is not None:
+            self.stats_event.cancel()
+            self.stats_event = None
+
+        if overlay:
+            self.stats_event = Clock.schedule_interval(self.show_stats, 1)
+
+    def show_stats(self, dt):
+        self.stats = self.latency.text()
+
+    def metrics(self):
+        yield from self.decoder.metrics()
+        labels = {"stream": self.feed.stream_id}
+
+        for stage, values in self.latency.summary().items():
+            for point, value in zip(PERCENTILES, values):
+                yield "latency_seconds", {
+                    **labels, "stage": stage,
+                    "quantile": point / 100}, value / 1000
+
+    def on_parent(self, instance, parent):
+        # Only streams on screen are decoded.
+        if parent is None:
+            self.feed.hide()
+
+        else:
+            self.feed.show()
 
     def set_image(self, *largs):
-        frame = imdecode(frombuffer(self.buffer, dtype=uint8), 1)
-        buf1 = flip(frame[:, :, ::-1], 0)
-        buf = buf1.tobytes()
-        image_texture = Texture.create(
-            size=(frame.shape[1], frame.shape[0]), colorfmt="rgb"
-        )
-        image_texture.blit_buffer(
-            buf,
-            colorfmt="rgb",
+        frame = self.decoder.take()
+
+        if frame is None:
+            if self.ready and self.feed.idle() > self.timeout:
+                self.set_ready_state(False)
+            return
+
+        if (self.frame_texture is None
+                or self.frame_texture.size != frame.size
+                or self.frame_texture.colorfmt != frame.colorfmt):
+            self.frame_texture = Texture.create(
+                size=frame.size, colorfmt=frame.colorfmt)
+            self.frame_texture.flip_vertical()
+            self.texture = self.frame_texture
+
+        shown = monotonic()
+        self.frame_texture.blit_buffer(
+            frame.pixels,
+            colorfmt=frame.colorfmt,
             bufferfmt="ubyte"
         )
-        self.texture = image_texture
+        self.latency.add(frame.stamps, shown, monotonic())
+        self.canvas.ask_update()
         self.set_ready_state(True)
-        self.buffer = b""
+        self.pick_layer(frame)
+        self.pick_reduction(frame)
+
+    def pick_layer(self, frame):
+        """Subscribe to the smallest layer still as wide as the widget."""
+        full = frame.size[0] * frame.reduction << frame.layer
+        layer = 0
+
+        while layer + 1 < LAYERS and full >> (layer + 1) >= self.width:
+            layer += 1
+
+        self.feed.layer = layer
+
+    def pick_reduction(self, frame):
+        """Decode JPEG frames no larger than the widget shows them."""
+        self.decoder.reduction = reduction_for(
+            (frame.size[0] * frame.reduction,
+             frame.size[1] * frame.reduction),
+            (self.width, self.height))
 
     def set_ready_state(self, b=False):
         self.color = (b, b, b, b)
         self.ready = b
 
 
+class StreamGrid(GridLayout):
+    """
+    Every camera sending to port 6666 in a grid, tapping
+    one shows it alone and tapping it again goes back
+    """
+    fps = NumericProperty(60)
+    ready = BooleanProperty(False)
+    timeout = NumericProperty(5)
+    # Comma separated 'host:port' of senders or relays to subscribe to.
+    upstream = StringProperty("")
+    # Multicast group the senders stream to.
+    group = StringProperty("")
+    # Stream id shown alone, -1 for the grid.
+    selected = NumericProperty(-1)
+    overlay = BooleanProperty(False)
+    jitter_buffer = BooleanProperty(False)
+    max_delay = NumericProperty(0.5)
+    # Kernel receive buffer in bytes, room for bursts while the UI
+    # thread stalls; net.core.rmem_max caps what is granted.
+    receive_buffer = NumericProperty(4 * 1024 * 1024)
+    receiver = None
+    event = None
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.streams = {}
+        self.s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.s.bind(("0.0.0.0", 6666))
+        self.s.settimeout(1)
+        self.receiver = FrameReceiver(
+            self.s, deadline=0.5, receive_buffer=int(self.receive_buffer))
+        self.receiver.start()
+        metrics.registry.register(self.receiver.metrics)
+        self.on_upstream(self, self.upstream)
+        self.on_group(self, self.group)
+        self.event = Clock.schedule_interval(self.check_feeds, 0.5)
+
+    def on_fps(self, instance, fps):
+        for stream in self.streams.values():
+            stream.fps = fps
+
+    def on_upstream(self, instance, upstream):
+        if self.receiver is not None:
+            self.receiver.upstreams = tuple(
+                (host, int(port)) for host, port in (
+                    address.strip().rsplit(":", 1)
+                    for address in upstream.split(",") if address.strip()))
+
+    def on_receive_buffer(self, instance, receive_buffer):
+        if self.receiver is not None:
+            self.receiver.resize(int(receive_buffer))
+
+    def on_group(self, instance, group):
+        if self.receiver is not None and group:
+            join_group(self.s, group)
+
+    def on_selected(self, instance, selected):
+        self.arrange()
+
+    def on_overlay(self, instance, overlay):
+        for stream in self.streams.values():
+            stream.overlay = overlay
+
+    def on_jitter_buffer(self, instance, jitter_buffer):
+        for stream in self.streams.values():
+            stream.jitter_buffer = jitter_buffer
+
+    def on_max_delay(self, instance, max_delay):
+        for stream in self.streams.values():
+            stream.max_delay = max_delay
+
+    def check_feeds(self, dt):
+        for stream_id, feed in self.receiver.feeds.items():
+            if stream_id not in self.streams:
+                self.streams[stream_id] = Stream(
+                    feed=feed, fps=self.fps, timeout=self.timeout,
+                    overlay=self.overlay, jitter_buffer=self.jitter_buffer,
+                    max_delay=self.max_delay)
+                metrics.registry.register(self.streams[stream_id].metrics)
+                self.arrange()
+
+        self.ready = any(
+            stream.ready for stream in self.streams.values())
+
+    def arrange(self):
+        """Lay out every stream, or only the selected one."""
+        shown = [
+            stream for stream_id, stream in sorted(self.streams.items())
+            if self.selected in (-1, stream_id)]
+        self.clear_widgets()
+        self.cols = max(1, ceil(sqrt(len(shown))))
+
+        for stream in shown:
+            self.add_widget(stream)
+
+        for stream in self.streams.values():
+            if stream.parent is None:
+                stream.feed.hide()
+
+    def on_touch_down(self, touch):
+        for stream in self.children:
+            if stream.collide_point(*touch.pos):
+                stream_id = stream.feed.stream_id
+                self.selected = -1 if self.selected == stream_id else (
+                    stream_id)
+                return True
+
+        return super().on_touch_down(touch)
+
+
 class CamApp(App):
     color_base = {
         "cold": (0.3, 0.3, 1, 0.5),
@@ -368,6 +562,9 @@ class CamApp(App):
     }
 
     def build(self):
+        # Counters, histograms and latency of every stream, see
+        # http://localhost:6681/metrics and /metrics.json.
+        metrics.serve(metrics.registry, 6681)
         self.root = Picture()
         Thread(target=self.setup).start()
 
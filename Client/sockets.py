@@ -0,0 +1,104 @@
+# coding: utf-8
+"""
+Kernel buffer sizes of the UDP sockets, and the datagrams the kernel
+dropped because a receive buffer was full before we read it.
+"""
+import logging
+import struct
+import sys
+from socket import (CMSG_SPACE, SO_RCVBUF, SO_SNDBUF, SOL_SOCKET,
+                    gethostbyname)
+
+LINUX = sys.platform.startswith("linux")
+# Not exported by the socket module, from <asm-generic/socket.h>.
+SO_RXQ_OVFL = 40
+DROPS = struct.Struct("=I")
+ANCILLARY_SIZE = CMSG_SPACE(DROPS.size)
+
+
+def buffer_size(sock, option):
+    """Bytes of a socket buffer that hold datagrams."""
+    size = sock.getsockopt(SOL_SOCKET, option)
+    # Linux doubles what was asked for its bookkeeping and reports that.
+    return size // 2 if LINUX else size
+
+
+def set_buffers(sock, receive=0, send=0):
+    """
+    Ask for receive and send buffers of these many bytes, 0 keeps
+    the default, and return the (receive, send) sizes granted.
+    """
+    for option, size, limit in (
+            (SO_RCVBUF, receive, "rmem_max"), (SO_SNDBUF, send, "wmem_max")):
+        if not size:
+            continue
+
+        sock.setsockopt(SOL_SOCKET, option, size)
+        granted = buffer_size(sock, option)
+
+        if granted < size:
+            logging.warning(
+                f"Asked for a {size} byte socket buffer and got {granted}, "
+                f"raise net.core.{limit} to allow more")
+
+    return buffer_size(sock, SO_RCVBUF), buffer_size(sock, SO_SNDBUF)
+
+
+def resolve(addr):
+    """
+    (host, port) with the host name looked up, the way datagrams
+    from it show up, or as it is when the lookup fails.
+    """
+    try:
+        return gethostbyname(addr[0]), addr[1]
+
+    except OSError as error:
+        logging.warning(f"Cannot resolve {addr[0]}: {error}")
+        return addr
+
+
+def count_drops(sock):
+    """
+    Have the kernel attach its drop count to received datagrams,
+    return False where it cannot.
+    """
+    if not LINUX:
+        return False
+
+    try:
+        sock.setsockopt(SOL_SOCKET, SO_RXQ_OVFL, 1)
+
+    except OSError:
+        return False
+
+    return True
+
+
+def drops_of(ancdata):
+    """Drop count attached to a datagram by recvmsg, or None."""
+    for level, kind, data in ancdata:
+        if level == SOL_SOCKET and kind == SO_RXQ_OVFL and (
+                len(data) >= DROPS.size):
+            return DROPS.unpack_from(data)[0]
+
+    return None
+
+
+def proc_drops(sock, path="/proc/net/udp"):
+    """Drops of a bound socket as /proc/net/udp lists them, or None."""
+    port = sock.getsockname()[1]
+
+    try:
+        with open(path) as table:
+            next(table)
+
+            for line in table:
+                fields = line.split()
+
+                if int(fields[1].rsplit(":", 1)[1], 16) == port:
+                    return int(fields[-1])
+
+    except (OSError, ValueError, IndexError, StopIteration):
+        pass
+
+    return None
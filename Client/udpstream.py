@@ -0,0 +1,855 @@
+# coding: utf-8
+import logging
+from collections import deque
+from heapq import heappop, heappush
+from socket import IP_ADD_MEMBERSHIP, IPPROTO_IP, inet_aton
+from socket import timeout as TimeoutException
+from threading import Event, Lock, Thread
+from time import monotonic
+
+from numpy import frombuffer, uint8
+
+from protocol import (FLAG_CLOCK, FLAG_H264, FLAG_PARITY, FLAG_TILES,
+                      FRAME_ID_MASK, HEADER_SIZE, MAX_DGRAM, TIME_MASK, age,
+                      control_flags, is_newer, pack_clock, pack_feedback,
+                      pack_subscribe, stream_of, timestamp, unpack_clock,
+                      unpack_header)
+from sockets import (ANCILLARY_SIZE, count_drops, drops_of, proc_drops,
+                     resolve, set_buffers)
+
+
+# A frame id this far behind the last one means the sender restarted,
+# not that a segment was delayed.
+RESTART_GAP = 256
+
+
+def superseded(frame_id, last_id):
+    """
+    Whether a frame is older than the last one handed on, but not
+    so much older that the sender must have restarted.
+    """
+    return last_id is not None and not is_newer(frame_id, last_id) and (
+        (last_id - frame_id) & FRAME_ID_MASK <= RESTART_GAP)
+
+
+class Frame:
+    """
+    A complete frame living in a slot borrowed from a FramePool
+    """
+    __slots__ = (
+        "frame_id", "slot", "size", "flags", "captured", "arrived",
+        "completed", "restart")
+
+    def __init__(self, frame_id, slot, size, flags=0, captured=0,
+                 arrived=0.0, completed=0.0, restart=False):
+        self.frame_id = frame_id
+        self.slot = slot
+        self.size = size
+        self.flags = flags
+        # Sender's capture time from the header, and when the first
+        # and last segments arrived here.
+        self.captured = captured
+        self.arrived = arrived
+        self.completed = completed
+        # First frame after the sender started its frame ids over.
+        self.restart = restart
+
+    @property
+    def data(self):
+        """View over the encoded frame, without copying it."""
+        return memoryview(self.slot)[:self.size]
+
+
+class FramePool:
+    """
+    Preallocated bytearray slots frames get reassembled into,
+    handed back once the frame has been decoded
+    """
+
+    def __init__(self, slots=4, size=4 * MAX_DGRAM):
+        self.lock = Lock()
+        self.free = [bytearray(size) for _ in range(slots)]
+
+    def acquire(self, size):
+        """Borrow a slot holding at least size bytes."""
+        with self.lock:
+            slot = self.free.pop() if self.free else None
+
+        if slot is None or len(slot) < size:
+            # Slots are never resized as views over them may still exist.
+            slot = bytearray(size)
+
+        return slot
+
+    def release(self, slot):
+        """Give a slot back to the pool."""
+        with self.lock:
+            self.free.append(slot)
+
+
+class _Partial:
+    __slots__ = (
+        "deadline", "slot", "size", "received", "missing",
+        "fec", "payload", "parity", "repaired", "flags", "captured",
+        "arrived")
+
+    def __init__(self, deadline, slot, size, total, fec, flags, captured,
+                 arrived):
+        self.deadline = deadline
+        self.slot = slot
+        self.size = size
+        self.received = bytearray(total)
+        self.missing = total
+        self.fec = fec
+        self.payload = 0
+        self.parity = {}
+        self.repaired = 0
+        self.flags = flags & ~FLAG_PARITY
+        self.captured = captured
+        self.arrived = arrived
+
+
+class Reassembler:
+    """
+    Collect the segments of each frame by frame id
+    and hand out frames only once they are complete
+    """
+    def __init__(self, deadline=0.5, pool=None):
+        self.deadline = deadline
+        self.pool = FramePool() if pool is None else pool
+        self.frames = {}
+        self.last_id = None
+        self.completed_at = None
+        self.restarted = False
+        self.restarts = 0
+        self.completed = 0
+        self.recovered = 0
+        self.dropped = 0
+        self.late = 0
+        self.received = 0
+        self.expected = 0
+        self.bytes = 0
+        # Segments of frames already done with, and segments whose
+        # header disagrees with the first one of their frame.
+        self.stale = 0
+        self.mismatched = 0
+
+    def push(self, datagram, now=None):
+        """Store one datagram, return the Frame it completes or None."""
+        (flags, frame_id, index, total,
+         length, offset, size, fec, captured) = unpack_header(datagram)
+
+        if self.last_id is not None and not is_newer(frame_id, self.last_id):
+            now = monotonic() if now is None else now
+
+            if superseded(frame_id, self.last_id) and (
+                    now - self.completed_at <= self.deadline):
+                # Late segment of a frame already shown or given up on.
+                self.stale += 1
+                return None
+
+            # Far behind, or after a pause: the sender started over.
+            self.restart()
+
+        entry = self.frames.get(frame_id)
+
+        if entry is None:
+            now = monotonic() if now is None else now
+            self.expire(now)
+            entry = _Partial(
+                now + self.deadline, self.pool.acquire(size),
+                size, total, fec, flags, captured, now)
+            self.frames[frame_id] = entry
+
+        if (len(entry.received) != total or entry.size != size
+                or entry.fec != fec):
+            self.mismatched += 1
+            return None
+
+        payload = memoryview(datagram)[HEADER_SIZE:HEADER_SIZE + length]
+        fec_n, fec_k = fec
+
+        if flags & FLAG_PARITY:
+            if index in entry.parity:
+                return None
+
+            entry.parity[index] = bytes(payload)
+            entry.payload = length
+            self.repair(entry, index // fec_k, index % fec_k)
+
+        else:
+            if entry.received[index]:
+                return None
+
+            entry.slot[offset:offset + length] = payload
+            entry.received[index] = 1
+            entry.missing -= 1
+            self.received += 1
+            self.bytes += length
+
+            if entry.parity:
+                self.repair(entry, index // fec_n, index % fec_n % fec_k)
+
+        if entry.missing:
+            return None
+
+        del self.frames[frame_id]
+        self.completed += 1
+        self.recovered += entry.repaired > 0
+        self.expected += total
+        self.last_id = frame_id
+        self.completed_at = monotonic() if now is None else now
+        self.discard_older(frame_id)
+        restart, self.restarted = self.restarted, False
+
+        return Frame(
+            frame_id, entry.slot, size, entry.flags, entry.captured,
+            entry.arrived, self.completed_at, restart)
+
+    def restart(self):
+        """Forget the frame ids of a sender that started over."""
+        for stale in list(self.frames):
+            self.drop(stale)
+
+        self.last_id = None
+        self.restarted = True
+        self.restarts += 1
+
+    def repair(self, entry, group, j):
+        """Rebuild the only missing data segment a parity covers."""
+        fec_n, fec_k = entry.fec
+        parity = entry.parity.get(group * fec_k + j)
+
+        if parity is None or not entry.missing:
+            return
+
+        covered = range(
+            group * fec_n + j,
+            min((group + 1) * fec_n, len(entry.received)), fec_k)
+        missing = [i for i in covered if not entry.received[i]]
+
+        if len(missing) != 1:
+            return
+
+        payload = entry.payload
+        block = frombuffer(parity, dtype=uint8).copy()
+
+        for i in covered:
+            start = i * payload
+            end = min(start + payload, entry.size)
+
+            if i != missing[0]:
+                block[:end - start] ^= frombuffer(
+                    entry.slot, dtype=uint8, count=end - start, offset=start)
+
+        start = missing[0] * payload
+        end = min(start + payload, entry.size)
+        entry.slot[start:end] = block.data[:end - start]
+        entry.received[missing[0]] = 1
+        entry.missing -= 1
+        entry.repaired += 1
+
+    def release(self, frame):
+        """Return the slot of a consumed frame to the pool."""
+        self.pool.release(frame.slot)
+
+    def drop(self, frame_id):
+        """Give up on a partial frame."""
+        entry = self.frames.pop(frame_id)
+        self.pool.release(entry.slot)
+        self.expected += len(entry.received)
+        self.dropped += 1
+
+    def discard_older(self, frame_id):
+        """Drop partial frames superseded by a complete one."""
+        for stale in [i for i in self.frames if not is_newer(i, frame_id)]:
+            self.drop(stale)
+
+    def expire(self, now):
+        """Drop partial frames whose deadline has passed."""
+        for stale in [i for i, e in self.frames.items() if e.deadline < now]:
+            self.drop(stale)
+            self.late += 1
+
+
+class LatestFrame:
+    """
+    Lock-free hand-over of the newest complete frame, older frames
+    are recycled as soon as they are overtaken; ordered, every frame
+    is handed over in turn unless depth frames pile up
+    """
+
+    def __init__(self, release=None, ordered=False, depth=8):
+        self.release = release
+        self.queue = deque()
+        self.ordered = ordered
+        self.depth = depth
+        self.overtaken = 0
+
+    def put(self, frame):
+        """Offer a frame, recycling any frame nobody took yet."""
+        # deque.append/popleft/pop are atomic, so every frame is popped
+        # exactly once: either shown by take() or recycled here.
+        self.queue.append(frame)
+
+        while len(self.queue) > (self.depth if self.ordered else 1):
+            try:
+                stale = self.queue.popleft()
+
+            except IndexError:
+                break
+
+            self.overtaken += 1
+
+            if self.release is not None:
+                self.release(stale)
+
+    def take(self, now=None):
+        """Return the newest frame, or the oldest if ordered, or None."""
+        try:
+            return self.queue.popleft() if self.ordered else self.queue.pop()
+
+        except IndexError:
+            return None
+
+    def due_in(self, now):
+        """Frames are due as soon as they arrive."""
+        return None
+
+    def clear(self):
+        """Recycle the frames nobody took."""
+        frame = self.take()
+
+        while frame is not None:
+            if self.release is not None:
+                self.release(frame)
+
+            frame = self.take()
+
+
+class JitterBuffer:
+    """
+    Complete frames held back to play out at the pace they were
+    captured, after a delay that follows the measured jitter
+    """
+
+    def __init__(self, release=None, min_delay=0.0, max_delay=0.5,
+                 window=120, ordered=False):
+        self.release = release
+        # Release every due frame in turn instead of only the newest.
+        self.ordered = ordered
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.lock = Lock()
+        # (due, sequence, frame) heap.
+        self.frames = []
+        self.seq = 0
+        # Transit of the last window frames, capture to completion up
+        # to the unknown offset between the two clocks.
+        self.transits = deque(maxlen=window)
+        self.reference = None
+        # RFC 3550 interarrival jitter, and the delay frames are held.
+        self.jitter = 0.0
+        self.delay = min_delay
+        self.last_id = None
+        self.late = 0
+        self.overtaken = 0
+
+    def transit(self, frame):
+        """Seconds from capture to completion, plus a constant."""
+        if self.reference is None:
+            self.reference = (
+                timestamp(frame.completed) - frame.captured) & TIME_MASK
+
+        # Relative to the first frame, so the 32 bit stamps never wrap
+        # between two frames.
+        return age(
+            (frame.captured + self.reference) & TIME_MASK, frame.completed)
+
+    def put(self, frame):
+        """Hold a frame until its playout time, drop it if late."""
+        with self.lock:
+            stale = []
+
+            if frame.restart:
+                # Ids and capture times of the old run mean nothing now.
+                stale = [held for _, _, held in self.frames]
+                self.frames = []
+                self.last_id = None
+                self.transits.clear()
+                self.reference = None
+
+            transit = self.transit(frame)
+
+            if self.transits:
+                step = abs(transit - self.transits[-1])
+
+                if step > 2 * self.max_delay:
+                    # The sender restarted or its clock jumped.
+                    self.transits.clear()
+                    self.reference = None
+                    transit = self.transit(frame)
+
+                else:
+                    self.jitter += (step - self.jitter) / 16
+
+            self.transits.append(transit)
+            base = min(self.transits)
+            wanted = min(self.max_delay, max(
+                self.min_delay, max(self.transits) - base))
+            # Grows at once so no frame comes too late, shrinks slowly
+            # so playout does not speed up noticeably.
+            self.delay = wanted if wanted > self.delay else (
+                self.delay + 0.02 * (wanted - self.delay))
+            # As if it had the shortest transit, plus the delay.
+            due = frame.completed - (transit - base) + self.delay
+
+            if due < frame.completed or (
+                    not frame.restart
+                    and superseded(frame.frame_id, self.last_id)):
+                self.late += 1
+                late = True
+
+            else:
+                heappush(self.frames, (due, self.seq, frame))
+                self.seq += 1
+                late = False
+
+        if late:
+            stale.append(frame)
+
+        if self.release is not None:
+            for old in stale:
+                self.release(old)
+
+    def take(self, now=None):
+        """Return the newest (oldest if ordered) due frame, or None."""
+        now = monotonic() if now is None else now
+        frame = None
+        stale = []
+
+        with self.lock:
+            while self.frames and self.frames[0][0] <= now:
+                _, _, due = heappop(self.frames)
+
+                if not due.restart and superseded(
+                        due.frame_id, self.last_id):
+                    self.late += 1
+                    stale.append(due)
+                    continue
+
+                if frame is not None:
+                    self.overtaken += 1
+                    stale.append(frame)
+
+                frame = due
+                self.last_id = frame.frame_id
+
+                if self.ordered:
+                    break
+
+        if self.release is not None:
+            for old in stale:
+                self.release(old)
+
+        return frame
+
+    def due_in(self, now):
+        """Seconds until the next frame is due, or None."""
+        with self.lock:
+            return self.frames[0][0] - now if self.frames else None
+
+    def clear(self):
+        """Recycle every frame held."""
+        with self.lock:
+            frames = [frame for _, _, frame in self.frames]
+            self.frames = []
+
+        if self.release is not None:
+            for frame in frames:
+                self.release(frame)
+
+
+class ClockOffset:
+    """
+    Offset of a sender's clock from ours, from the ping with
+    the shortest round trip among the last few
+    """
+
+    def __init__(self, samples=8):
+        self.samples = deque(maxlen=samples)
+        self.offset = None
+        self.rtt = None
+
+    def add(self, pinged, ponged, now):
+        """Take a pong, times in seconds of each side's clock."""
+        rtt = now - pinged
+
+        if rtt < 0:
+            return
+
+        # The sender's clock is read halfway through the round trip.
+        self.samples.append((rtt, ponged - (pinged + now) / 2))
+        self.rtt, self.offset = min(self.samples)
+
+
+class Feed:
+    """
+    Reassembly state and newest frame of one camera's stream,
+    frames of a feed nobody shows are recycled right away
+    """
+
+    def __init__(self, stream_id, reassembler):
+        self.stream_id = stream_id
+        self.reassembler = reassembler
+        self.latest = LatestFrame(reassembler.release)
+        self.received_at = monotonic()
+        self.arrived = Event()
+        self.decode_time = 0.0
+        self.remote = None
+        self.visible = True
+        # Simulcast layer to subscribe to.
+        self.layer = 0
+        self.clock = ClockOffset()
+        # Complete frames recycled while nothing showed the stream.
+        self.hidden = 0
+        # Share of segments lost over the last feedback interval.
+        self.loss = 0.0
+        self.reported = self.counters()
+
+    def push(self, datagram, remote):
+        """Reassemble one datagram of this stream."""
+        self.remote = remote
+        frame = self.reassembler.push(datagram)
+
+        if frame is None:
+            return
+
+        self.received_at = monotonic()
+
+        if not self.visible:
+            # Nothing shows this camera, so it is not decoded either.
+            self.hidden += 1
+            self.reassembler.release(frame)
+            return
+
+        # Inter-frame codecs decode every frame, intra ones only the newest.
+        self.latest.ordered = bool(frame.flags & (FLAG_H264 | FLAG_TILES))
+        self.latest.put(frame)
+        self.arrived.set()
+
+    def hide(self):
+        """Stop handing frames to the decoder."""
+        self.visible = False
+        self.latest.clear()
+
+    def show(self):
+        self.visible = True
+
+    def counters(self):
+        r = self.reassembler
+        return r.received, r.expected, r.late, r.bytes
+
+    def report(self, elapsed):
+        """Feedback for the sender on the last interval, or None."""
+        counters = self.counters()
+        received, expected, late, received_bytes = (
+            after - before for after, before in zip(counters, self.reported))
+        self.reported = counters
+
+        if self.remote is None or not expected:
+            return None
+
+        self.loss = max(0.0, 1 - received / expected)
+
+        return pack_feedback(
+            self.loss, late,
+            self.decode_time, received_bytes / elapsed)
+
+    def take(self):
+        """Return the newest complete frame due to be shown, if any."""
+        return self.latest.take()
+
+    def wait(self, timeout=0.5):
+        """Block until a frame may have arrived or fallen due."""
+        due = self.latest.due_in(monotonic())
+        self.arrived.wait(timeout if due is None else min(timeout, due))
+
+    def set_playout(self, jitter_buffer, max_delay=0.5):
+        """Hand frames over as they complete, or through a jitter buffer."""
+        latest = self.latest
+
+        if isinstance(latest, JitterBuffer) == bool(jitter_buffer):
+            latest.max_delay = max_delay
+            return
+
+        self.latest = (
+            JitterBuffer(
+                self.reassembler.release, max_delay=max_delay,
+                ordered=latest.ordered)
+            if jitter_buffer else LatestFrame(
+                self.reassembler.release, latest.ordered))
+        latest.clear()
+
+    @property
+    def ordered(self):
+        """Whether every frame has to be decoded, in order."""
+        return self.latest.ordered
+
+    def release(self, frame):
+        """Hand a shown frame back to the pool."""
+        self.reassembler.release(frame)
+
+    def idle(self):
+        """Seconds since the last complete frame."""
+        return monotonic() - self.received_at
+
+    def metrics(self):
+        r = self.reassembler
+        labels = {"stream": self.stream_id}
+        yield "frames_received_total", labels, r.completed
+        yield "frames_recovered_total", labels, r.recovered
+        yield "sender_restarts_total", labels, r.restarts
+
+        for reason, count in (
+                ("deadline", r.late), ("superseded", r.dropped - r.late)):
+            yield "frames_incomplete_total", {
+                **labels, "reason": reason}, count
+
+        for reason, count in (
+                ("hidden", self.hidden),
+                ("overtaken", self.latest.overtaken)):
+            yield "frames_dropped_total", {**labels, "reason": reason}, count
+
+        for reason, count in (
+                ("stale", r.stale), ("mismatched", r.mismatched)):
+            yield "segments_discarded_total", {
+                **labels, "reason": reason}, count
+
+        yield "segments_received_total", labels, r.received
+        yield "segments_expected_total", labels, r.expected
+        yield "bytes_received_total", labels, r.bytes
+        yield "frames_partial", labels, len(r.frames)
+        yield "segment_loss_ratio", labels, self.loss
+
+        if isinstance(self.latest, JitterBuffer):
+            yield "frames_dropped_total", {
+                **labels, "reason": "late"}, self.latest.late
+            yield "playout_delay_seconds", labels, self.latest.delay
+            yield "jitter_seconds", labels, self.latest.jitter
+
+        if self.clock.offset is not None:
+            yield "clock_offset_seconds", labels, self.clock.offset
+            yield "clock_rtt_seconds", labels, self.clock.rtt
+
+    def network_time(self, frame):
+        """Seconds from capture to the first segment, None unsynced."""
+        offset = self.clock.offset
+
+        if offset is None:
+            return None
+
+        return age(frame.captured, frame.arrived + offset)
+
+
+class FrameReceiver:
+    """
+    Long-lived reader owning the socket, it reassembles the frames
+    of every camera off the UI thread into one Feed per stream id
+    """
+
+    def __init__(self, sock, deadline=0.5, feedback_interval=1.0,
+                 upstreams=(), heartbeat=1.0, receive_buffer=0):
+        self.s = sock
+        self.deadline = deadline
+        # Replaced, never changed in place, so other threads can
+        # iterate it while a new camera shows up.
+        self.feeds = {}
+        self.scratch = memoryview(bytearray(MAX_DGRAM))
+        self.feedback_interval = feedback_interval
+        # Senders or relays (host, port) to subscribe to with heartbeats.
+        self.upstreams = tuple(upstreams)
+        # Addresses of the upstreams, looked up once on this thread.
+        self.resolved = {}
+        self.heartbeat = heartbeat
+        # Bursts of segments the UI thread is too slow for wait here.
+        self.resize(receive_buffer)
+        # Datagrams the kernel dropped on a full receive buffer, from
+        # each datagram's ancillary data or else from /proc/net/udp.
+        self.counting = count_drops(sock)
+        self.kernel_drops = 0
+        self.reported_drops = 0
+        self.running = False
+
+    def start(self):
+        self.running = True
+        Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def resize(self, receive_buffer):
+        """Ask for a receive buffer of that many bytes, 0 keeps it."""
+        self.receive_buffer = set_buffers(self.s, receive_buffer)[0]
+
+    def receive(self):
+        """Read one datagram into the scratch buffer."""
+        if not self.counting:
+            return self.s.recvfrom_into(self.scratch)
+
+        size, ancdata, _, remote = self.s.recvmsg_into(
+            [self.scratch], ANCILLARY_SIZE)
+
+        if ancdata:
+            drops = drops_of(ancdata)
+
+            if drops is not None:
+                self.kernel_drops = drops
+
+        return size, remote
+
+    def run(self):
+        reported_at = monotonic()
+        beat_at = None
+
+        while self.running:
+            now = monotonic()
+
+            if self.upstreams and (
+                    beat_at is None or now - beat_at >= self.heartbeat):
+                beat_at = now
+                self.subscribe()
+
+            try:
+                size, remote = self.receive()
+                datagram = self.scratch[:size]
+
+                if control_flags(datagram) == FLAG_CLOCK:
+                    self.pong(datagram, remote)
+
+                else:
+                    stream_id = stream_of(datagram)
+
+                    if stream_id not in self.feeds:
+                        # Stray datagrams must not show up as cameras.
+                        unpack_header(datagram)
+
+                    self.feed(stream_id).push(datagram, remote)
+
+            except TimeoutException:
+                pass
+
+            except ValueError as error:
+                logging.warning(error)
+                continue
+
+            except OSError as error:
+                if self.running:
+                    logging.critical(error)
+                break
+
+            now = monotonic()
+
+            if self.feedback_interval and (
+                    now - reported_at >= self.feedback_interval):
+                self.report(now - reported_at)
+                reported_at = now
+
+    def feed(self, stream_id):
+        """Feed of a stream id, created when its first segment arrives."""
+        feed = self.feeds.get(stream_id)
+
+        if feed is None:
+            feed = Feed(stream_id, Reassembler(self.deadline))
+            self.feeds = {**self.feeds, stream_id: feed}
+
+        return feed
+
+    def metrics(self):
+        yield "socket_drops_total", {}, self.kernel_drops
+        yield "socket_receive_buffer_bytes", {}, self.receive_buffer
+
+        for feed in self.feeds.values():
+            yield from feed.metrics()
+
+    def subscribe(self):
+        """Ask every upstream to keep sending frames here."""
+        layers = {feed.remote: feed.layer for feed in self.feeds.values()}
+
+        for upstream in self.upstreams:
+            if upstream not in self.resolved:
+                # Frames come from the address, not the host name.
+                self.resolved[upstream] = resolve(upstream)
+
+            address = self.resolved[upstream]
+
+            try:
+                self.s.sendto(
+                    pack_subscribe(layers.get(address, 0)), address)
+
+            except OSError as error:
+                logging.warning(error)
+
+    def report(self, elapsed):
+        """Tell each sender how the last interval went."""
+        for feed in self.feeds.values():
+            feedback = feed.report(elapsed)
+
+            if feedback is None:
+                continue
+
+            try:
+                self.s.sendto(feedback, feed.remote)
+
+            except OSError as error:
+                logging.warning(error)
+
+        self.check_drops()
+        self.ping()
+
+    def check_drops(self):
+        """Log datagrams the kernel dropped next to the loss we saw."""
+        if not self.counting:
+            drops = proc_drops(self.s)
+            self.kernel_drops = self.kernel_drops if drops is None else drops
+
+        dropped = self.kernel_drops - self.reported_drops
+        self.reported_drops = self.kernel_drops
+
+        if dropped > 0:
+            loss = ", ".join(
+                f"stream {feed.stream_id} {feed.loss:.1%}"
+                for feed in self.feeds.values())
+            logging.warning(
+                f"Receive buffer of {self.receive_buffer} bytes overran, "
+                f"the kernel dropped {dropped} datagrams; segment loss "
+                f"{loss}")
+
+    def ping(self):
+        """Ask each sender for its clock."""
+        ping = pack_clock(monotonic())
+
+        for remote in {feed.remote for feed in self.feeds.values()}:
+            if remote is None:
+                continue
+
+            try:
+                self.s.sendto(ping, remote)
+
+            except OSError as error:
+                logging.warning(error)
+
+    def pong(self, datagram, remote):
+        """Update the clock offset of every feed from that sender."""
+        now = monotonic()
+        pinged, ponged = unpack_clock(datagram)
+
+        for feed in self.feeds.values():
+            if feed.remote == remote:
+                feed.clock.add(pinged, ponged, now)
+
+
+def join_group(sock, group):
+    """Receive the datagrams sent to a multicast group."""
+    sock.setsockopt(
+        IPPROTO_IP, IP_ADD_MEMBERSHIP, inet_aton(group) + inet_aton("0.0.0.0"))
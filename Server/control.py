@@ -0,0 +1,107 @@
+# coding: utf-8
+import logging
+from threading import Thread
+from time import monotonic
+
+from protocol import (FLAG_CLOCK, FLAG_SUBSCRIBE, control_flags, pack_clock,
+                      unpack_clock, unpack_feedback, unpack_subscribe)
+
+
+class QualityController:
+    """
+    Adapt the JPEG quality, and then the scale, of a FrameSegment
+    to the reports the receiver sends back
+    """
+    SCALES = (1.0, 0.75, 0.5)
+
+    def __init__(self, segment, framerate, byte_rate=4_000_000,
+                 max_loss=0.02, min_quality=20, max_quality=None):
+        self.segment = segment
+        self.framerate = framerate
+        # Bytes a second the receiver may report before the stream
+        # counts as congested, like its feedback, 4 MB/s is 32 Mbit/s.
+        self.byte_rate = byte_rate
+        self.max_loss = max_loss
+        self.min_quality = min_quality
+        self.max_quality = (
+            segment.quality if max_quality is None else max_quality)
+        self.scale_index = 0
+        self.clean = 0
+        self.running = False
+
+    def start(self):
+        self.running = True
+        Thread(target=self.listen, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def listen(self):
+        sock = self.segment.s
+
+        if sock.getsockname()[1] == 0:
+            # Reports and heartbeats come back to the port frames
+            # are sent from.
+            sock.bind(("0.0.0.0", 0))
+
+        while self.running:
+            try:
+                data, addr = sock.recvfrom(64)
+                kind = control_flags(data)
+
+                if kind == FLAG_SUBSCRIBE:
+                    self.segment.subscribers.renew(
+                        addr, layer=unpack_subscribe(data))
+
+                elif kind == FLAG_CLOCK:
+                    # Echo the ping with our clock so the receiver can
+                    # place capture times on its own.
+                    sock.sendto(
+                        pack_clock(unpack_clock(data)[0], monotonic()), addr)
+
+                else:
+                    self.update(*unpack_feedback(data))
+
+            except ValueError as error:
+                logging.warning(error)
+
+            except OSError:
+                break
+
+    def congested(self, loss, late, decode_time, rate):
+        return (
+            loss > self.max_loss or late > 0
+            or decode_time > 1 / self.framerate
+            or rate > self.byte_rate)
+
+    def update(self, loss, late, decode_time, rate):
+        """Step quality down fast when congested, up slowly when not."""
+        quality = self.segment.quality
+
+        if self.congested(loss, late, decode_time, rate):
+            self.clean = 0
+
+            # Camera JPEGs sent as they are only get smaller scaled.
+            if quality > self.min_quality and not self.segment.passthrough:
+                quality = max(self.min_quality, int(quality * 0.8))
+
+            elif self.scale_index + 1 < len(self.SCALES):
+                self.scale_index += 1
+                quality = self.max_quality
+
+        else:
+            self.clean += 1
+
+            if self.clean < 3:
+                return
+
+            self.clean = 0
+
+            if quality < self.max_quality:
+                quality = min(self.max_quality, quality + 5)
+
+            elif self.scale_index:
+                self.scale_index -= 1
+                quality = self.min_quality
+
+        self.segment.set_quality(quality, self.SCALES[self.scale_index])
@@ -2,87 +2,238 @@
 # coding: utf-8
 from __future__ import division
 
-import struct
-from math import ceil
+import argparse
+from itertools import islice
 from socket import AF_INET, SOCK_DGRAM, socket
+from threading import Thread
+from time import monotonic, sleep
 
 import cv2
-from imutils.video import FPS
 
+import jpeg
+import metrics
+from control import QualityController
+from segment import FrameSegment
+from sockets import set_buffers
+from source import JpegFrames, SourceFrame
 
-class FrameSegment:
-    """
-    Object to break down image frame segment
-    if the size of image exceed maximum datagram size
-    """
-
-    MAX_DGRAM = 2 ** 16
-    MAX_IMAGE_DGRAM = MAX_DGRAM - 64
-
-    def __init__(self, sock, port, addr, quality):
-        self.s = sock
-        self.port = port
-        self.addr = addr
-        self.quality = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
-
-    def udp_frame(self, img):
-        """
-        Compress image and Break down
-        into data segments
-        """
-        compress_img = cv2.imencode(
-            '.jpg', img, self.quality
-        )[1]
-
-        dat = compress_img.tobytes()
-        size = len(dat)
-        count = ceil(size / self.MAX_IMAGE_DGRAM)
-        start = 0
-
-        while count:
-            end = min(
-                size, start + self.MAX_IMAGE_DGRAM
-            )
-            self.s.sendto(
-                struct.pack("B", count) + dat[start: end],
-                (
-                    self.addr,
-                    self.port
-                )
-            )
-            start = end
-            count -= 1
-
+SIZE = (1280, 720)
 
-if __name__ == "__main__":
-    remote = '192.168.3.8'
-    port = 6666
-
-    s = socket(AF_INET, SOCK_DGRAM)
-    fs = FrameSegment(s, port, remote, quality=30)
 
-    cap = cv2.VideoCapture('/home/user/Videos/test.mp4')
-
-    fps = FPS().start()
+def clip_frames(path, size, loop=True):
+    """Frames of a video file at the stream size."""
+    cap = cv2.VideoCapture(path)
 
     while(cap.isOpened()):
         ret, image = cap.read()
 
         if ret:
-            image = cv2.resize(
-                image, (1280, 720), interpolation=cv2.INTER_AREA
-            )
-            fs.udp_frame(image)
-            cv2.imshow('Frame', image)
+            yield SourceFrame(
+                cv2.resize(image, size, interpolation=cv2.INTER_AREA))
 
-        else:
+        elif loop:
             cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
 
-        if cv2.waitKey(1) & 0xFF == ord('q'):
+        else:
             break
 
-        fps.update()
 
-    fps.stop()
-    print('FPS:', fps.fps())
+class Replay:
+    """
+    One synthetic stream sending cached JPEGs on a fixed schedule,
+    either fps frames a second or bitrate bits a second
+    """
+
+    def __init__(self, segment, jpegs, fps=30, bitrate=None):
+        self.segment = segment
+        self.jpegs = jpegs
+        self.fps = fps
+        self.bitrate = bitrate
+        # Frames sent after their slot had already passed.
+        self.late = 0
+        self.running = False
+
+    def start(self):
+        self.running = True
+        Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def interval(self, size):
+        """Seconds until the frame after one of size bytes."""
+        if self.bitrate:
+            return size * 8 / self.bitrate
+
+        return 1 / self.fps
+
+    def run(self):
+        due = monotonic()
+
+        for frame in JpegFrames(self.jpegs):
+            if not self.running:
+                break
+
+            delay = due - monotonic()
+
+            if delay > 0:
+                sleep(delay)
+
+            elif delay < -self.interval(len(frame.jpeg)):
+                # Too far behind to catch up without a burst.
+                self.late += 1
+                due = monotonic()
+
+            self.segment.udp_frame(frame)
+            # Slots are kept on an absolute schedule, so sleeping
+            # late once does not slow the rate down.
+            due += self.interval(len(frame.jpeg))
+
+    def metrics(self):
+        yield "frames_late_total", {"stream": self.segment.stream}, self.late
+        yield from self.segment.metrics()
+
+
+def headless(args, jpegs):
+    """Replay the cache on many streams and report the rate reached."""
+    replays = []
+
+    for i in range(args.streams):
+        s = socket(AF_INET, SOCK_DGRAM)
+        set_buffers(s, send=args.sndbuf)
+        fs = FrameSegment(
+            s, args.port, args.remote,
+            quality=args.quality, codec=args.codec, stream=args.stream + i,
+            layers=args.layers)
+        replays.append(Replay(fs, jpegs, args.fps, args.bitrate))
+
+    for replay in replays:
+        metrics.registry.register(replay.metrics)
+        replay.start()
+
+    started = previous = monotonic()
+    counted = (0, 0)
+
+    try:
+        while not args.duration or monotonic() - started < args.duration:
+            sleep(1.0)
+            now = monotonic()
+            totals = (
+                sum(r.segment.frame_id for r in replays),
+                sum(r.segment.bytes_sent for r in replays))
+            frames, sent = (a - b for a, b in zip(totals, counted))
+            print(f"{frames / (now - previous):8.1f} frames/s "
+                  f"{sent * 8 / (now - previous) / 1e6:8.2f} Mbit/s "
+                  f"over {len(replays)} streams, "
+                  f"{sum(r.late for r in replays)} late")
+            counted, previous = totals, now
+
+    except KeyboardInterrupt:
+        pass
+
+    for replay in replays:
+        replay.stop()
+
+    elapsed = monotonic() - started
+    print(f"Average {counted[0] / elapsed:.1f} frames/s, "
+          f"{counted[1] * 8 / elapsed / 1e6:.2f} Mbit/s "
+          f"({counted[0] / elapsed / len(replays):.1f} frames/s, "
+          f"{counted[1] * 8 / elapsed / len(replays) / 1e6:.2f} Mbit/s "
+          f"per stream)")
+
+    for replay in replays:
+        replay.segment.s.close()
+
+
+def window(args, jpegs=None):
+    """Send the clip as fast as it plays and show it."""
+    s = socket(AF_INET, SOCK_DGRAM)
+    set_buffers(s, send=args.sndbuf)
+    fs = FrameSegment(
+        s, args.port, args.remote, quality=args.quality, codec=args.codec,
+        stream=args.stream, layers=args.layers)
+    controller = QualityController(fs, framerate=30)
+    controller.start()
+    metrics.registry.register(fs.metrics)
+
+    if jpegs:
+        source = JpegFrames(jpegs)
+
+    else:
+        source = clip_frames(args.clip, SIZE)
+
+    started = monotonic()
+
+    for frame in source:
+        fs.udp_frame(frame)
+        cv2.imshow('Frame', frame.array(2))
+
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            break
+
+    print('FPS:', fs.frame_id / (monotonic() - started))
+    print('Bytes/frame:', fs.bytes_sent // max(fs.frame_id, 1))
+    controller.stop()
     s.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--codec', default='mjpeg', choices=('mjpeg', 'h264', 'tiles'))
+    parser.add_argument('--stream', type=int, default=0)
+    parser.add_argument('--layers', type=int, default=1)
+    parser.add_argument(
+        '--passthrough', action='store_true',
+        help="encode the clip once and send the JPEGs as they are, "
+             "like the camera's MJPEG")
+    parser.add_argument('--cache', type=int, default=300)
+    parser.add_argument(
+        '--headless', action='store_true',
+        help="no window, replay the cached JPEGs on a fixed schedule")
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument(
+        '--bitrate', type=float, help="bits/s per stream instead of --fps")
+    parser.add_argument('--streams', type=int, default=1)
+    parser.add_argument(
+        '--duration', type=float, default=0, help="seconds, 0 runs on")
+    parser.add_argument('--remote', default='192.168.3.8')
+    parser.add_argument('--port', type=int, default=6666)
+    parser.add_argument('--clip', default='/home/user/Videos/test.mp4')
+    parser.add_argument('--quality', type=int, default=60)
+    parser.add_argument(
+        '--sndbuf', type=int, default=0,
+        help="kernel send buffer in bytes, 0 keeps the default")
+    parser.add_argument(
+        '--metrics-port', type=int, default=0,
+        help="serve metrics on this local port, 0 does not")
+    args = parser.parse_args()
+
+    # Stream ids travel in one byte of the header.
+    if args.streams < 1 or not 0 <= args.stream <= 256 - args.streams:
+        parser.error(
+            f"--stream {args.stream} and --streams {args.streams} have "
+            f"to keep stream ids within 0..255")
+
+    if args.metrics_port:
+        metrics.serve(metrics.registry, args.metrics_port)
+
+    jpegs = None
+
+    if args.passthrough or args.headless:
+        jpegs = [
+            jpeg.backend.encode(frame.image, args.quality)
+            for frame in islice(
+                clip_frames(args.clip, SIZE, loop=False), args.cache)]
+
+        if not jpegs:
+            parser.error(f"No frames in {args.clip}")
+
+        print(f"{len(jpegs)} frames cached, "
+              f"{sum(map(len, jpegs)) // len(jpegs)} bytes each")
+
+    if args.headless:
+        headless(args, jpegs)
+
+    else:
+        window(args, jpegs)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Subscriber bookkeeping for sending one encoded stream to many
+receivers, and a relay that does the same for a sender elsewhere.
+"""
+import argparse
+import logging
+from socket import AF_INET, SOCK_DGRAM, socket
+from socket import timeout as TimeoutException
+from threading import Lock
+from time import monotonic
+
+from protocol import (FLAG_CLOCK, FLAG_FEEDBACK, FLAG_SUBSCRIBE,
+                      MAX_DGRAM, control_flags, pack_subscribe)
+from sockets import set_buffers
+
+
+class Subscribers:
+    """
+    Receivers that asked for the stream, forgotten once their
+    heartbeats stop for timeout seconds
+    """
+
+    def __init__(self, timeout=5.0):
+        self.timeout = timeout
+        self.lock = Lock()
+        self.expiry = {}
+        self.layers = {}
+        # Rebuilt on every change, so it can be sent to while it changes.
+        self.addresses = ()
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def renew(self, addr, now=None, layer=0):
+        now = monotonic() if now is None else now
+
+        with self.lock:
+            if addr not in self.expiry:
+                logging.info(f"{addr[0]}:{addr[1]} subscribed")
+                self.addresses += (addr, )
+
+            self.expiry[addr] = now + self.timeout
+            self.layers[addr] = layer
+
+    def layer(self, addr):
+        """Simulcast layer a receiver asked for."""
+        return self.layers.get(addr, 0)
+
+    def active(self, now=None):
+        """Addresses of the receivers still sending heartbeats."""
+        now = monotonic() if now is None else now
+
+        with self.lock:
+            stale = [addr for addr, e in self.expiry.items() if e < now]
+
+            for addr in stale:
+                logging.info(f"{addr[0]}:{addr[1]} expired")
+                del self.expiry[addr]
+                del self.layers[addr]
+
+            if stale:
+                self.addresses = tuple(self.expiry)
+
+            return self.addresses
+
+
+def relay(sock, subscribers, upstream=None, heartbeat=1.0):
+    """
+    Forward the sender's datagrams to every subscriber and
+    the subscribers' reports back to the sender; with an upstream
+    the relay subscribes to the sender itself, to its full size layer
+    """
+    buffer = memoryview(bytearray(MAX_DGRAM))
+    source = None
+    beat_at = None
+
+    if upstream is not None:
+        sock.settimeout(heartbeat)
+
+    while True:
+        now = monotonic()
+
+        if upstream is not None and (
+                beat_at is None or now - beat_at >= heartbeat):
+            beat_at = now
+            sock.sendto(pack_subscribe(), upstream)
+
+        try:
+            size, addr = sock.recvfrom_into(buffer)
+
+        except TimeoutException:
+            continue
+
+        datagram = buffer[:size]
+        flags = control_flags(datagram)
+
+        try:
+            if flags == FLAG_SUBSCRIBE:
+                subscribers.renew(addr)
+
+            elif flags == FLAG_FEEDBACK:
+                if source is not None:
+                    sock.sendto(datagram, source)
+
+            elif flags == FLAG_CLOCK:
+                # The source's pong could not be told apart from those
+                # of other receivers, so clock pings end here.
+                continue
+
+            else:
+                source = addr
+
+                for destination in subscribers.active():
+                    sock.sendto(datagram, destination)
+
+        except OSError as error:
+            logging.warning(error)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=6666)
+    parser.add_argument(
+        '--upstream', help="host:port of the sender to subscribe to")
+    parser.add_argument('--timeout', type=float, default=5.0)
+    parser.add_argument(
+        '--rcvbuf', type=int, default=4 * 1024 * 1024,
+        help="kernel receive buffer in bytes, 0 keeps the default")
+    parser.add_argument(
+        '--sndbuf', type=int, default=0,
+        help="kernel send buffer in bytes, 0 keeps the default")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    s = socket(AF_INET, SOCK_DGRAM)
+    s.bind(("0.0.0.0", args.port))
+    receive, send = set_buffers(s, args.rcvbuf, args.sndbuf)
+    print(f"Relaying frames arriving on port {args.port}, "
+          f"buffers of {receive} bytes in and {send} out")
+
+    upstream = None
+
+    if args.upstream:
+        host, port = args.upstream.rsplit(":", 1)
+        upstream = (host, int(port))
+
+    try:
+        relay(s, Subscribers(args.timeout), upstream)
+
+    except KeyboardInterrupt:
+        pass
+
+    s.close()
@@ -0,0 +1,119 @@
+# coding: utf-8
+from time import monotonic, perf_counter
+
+from numpy import abs as np_abs
+from numpy import int16
+
+from jpeg import REDUCTIONS
+from source import SourceFrame
+
+
+class MotionGate:
+    """
+    Let every captured frame through while the scene moves,
+    and only a heartbeat every idle_interval seconds while it is still
+    """
+
+    def __init__(self, threshold=3.0, idle_interval=1.0, hold=2.0,
+                 step=8, reduction=1, budget=0.001):
+        self.threshold = threshold
+        self.idle_interval = idle_interval
+        # Seconds of full rate kept after the last motion.
+        self.hold = hold
+        # Every step-th pixel of every step-th row is compared.
+        self.step = step
+        self.min_step = step
+        # Pictures are compared at 1/reduction of their size, a camera
+        # JPEG is decoded that small in the first place.
+        self.reduction = reduction
+        self.min_reduction = reduction
+        # Seconds the detector, decoding included, may spend per frame.
+        self.budget = budget
+        self.cost = 0.0
+        self.score = 0.0
+        self.reference = None
+        self.sent_at = None
+        self.motion_at = None
+        self.checked = 0
+        self.skipped = 0
+
+    def sample(self, frame):
+        image = frame.array(self.reduction)
+        # The green channel carries most of the luma and needs no math.
+        return image[::self.step, ::self.step, 1].astype(int16)
+
+    def should_send(self, frame, now=None):
+        """Whether this image or SourceFrame is worth sending."""
+        start = perf_counter()
+        now = monotonic() if now is None else now
+        frame = frame if isinstance(frame, SourceFrame) else SourceFrame(
+            frame, captured=now)
+        sample = self.sample(frame)
+
+        if self.reference is not None and (
+                self.reference.shape == sample.shape):
+            # Compared with the last frame sent, so slow changes add up.
+            self.score = float(np_abs(sample - self.reference).mean())
+
+            if self.score > self.threshold:
+                self.motion_at = now
+
+        send = (
+            self.sent_at is None
+            or now - self.sent_at >= self.idle_interval
+            or (self.motion_at is not None
+                and now - self.motion_at < self.hold))
+
+        self.checked += 1
+
+        if send:
+            self.reference = sample
+            self.sent_at = now
+
+        else:
+            self.skipped += 1
+
+        self.limit(perf_counter() - start)
+
+        return send
+
+    def limit(self, elapsed):
+        """Decode smaller, then sample coarser, when over budget."""
+        self.cost += 0.1 * (elapsed - self.cost)
+
+        if self.cost > self.budget:
+            if self.reduction < max(REDUCTIONS):
+                self.reduction *= 2
+
+            elif self.step < 64:
+                self.step *= 2
+
+            else:
+                return
+
+            self.cost = self.budget / 2
+
+        elif self.cost < self.budget / 8:
+            if self.step > self.min_step:
+                self.step //= 2
+
+            elif self.reduction > self.min_reduction:
+                self.reduction //= 2
+
+            else:
+                return
+
+            self.cost = self.budget / 2
+
+    def metrics(self):
+        yield "frames_captured_total", {}, self.checked
+        yield "frames_dropped_total", {"reason": "still"}, self.skipped
+        yield "motion_score", {}, self.score
+        yield "motion_check_seconds", {}, self.cost
+        yield "motion_step", {}, self.step
+        yield "motion_reduction", {}, self.reduction
+
+    def idle(self, now=None):
+        """Whether the scene is currently considered still."""
+        now = monotonic() if now is None else now
+        return self.motion_at is None or now - self.motion_at >= self.hold
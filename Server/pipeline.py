@@ -0,0 +1,187 @@
+# coding: utf-8
+import logging
+from collections import deque
+from heapq import heappop, heappush
+from threading import Condition, Thread
+
+
+class DropQueue:
+    """
+    Bounded queue that drops its oldest item
+    instead of blocking the producer
+    """
+
+    def __init__(self, maxsize, cond=None):
+        self.maxsize = maxsize
+        self.items = deque()
+        # Shared with the consumer when it has to act on an item
+        # under the same lock it was taken with.
+        self.cond = Condition() if cond is None else cond
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item):
+        with self.cond:
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.dropped += 1
+
+            self.items.append(item)
+            self.cond.notify_all()
+
+    def get(self, timeout=None):
+        """Return the oldest item, or None once timeout passed."""
+        with self.cond:
+            if not self.items:
+                self.cond.wait(timeout)
+
+            return self.items.popleft() if self.items else None
+
+
+class Pipeline:
+    """
+    Capture -> encode -> send stages joined by bounded queues,
+    frames keep the order of their capture sequence number
+    """
+
+    def __init__(self, segment, workers=3, depth=2):
+        self.segment = segment
+        self.intra = all(encoder.intra for encoder in segment.encoders)
+        # Inter-frame codecs keep state, only one thread may encode.
+        self.workers = workers if self.intra else 1
+        self.depth = depth
+        self.cond = Condition()
+        self.captured = DropQueue(depth, self.cond)
+        self.inflight = set()
+        self.encoded = []
+        self.seq = 0
+        self.last_sent = -1
+        self.late = 0
+        self.dropped = 0
+        self.sent = 0
+        self.running = False
+
+    def start(self):
+        self.running = True
+
+        for _ in range(self.workers):
+            Thread(target=self.encoder, daemon=True).start()
+
+        Thread(target=self.sender, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+        with self.cond:
+            self.cond.notify_all()
+
+    def submit(self, image):
+        """Hand a captured image to the encoders."""
+        self.captured.put((self.seq, image))
+        self.seq += 1
+
+    def encoder(self):
+        while self.running:
+            with self.cond:
+                # Later frames of inter-frame codecs refer to every
+                # encoded one, so the encoder waits for room and leaves
+                # dropping to the capture queue.
+                if not self.intra and (
+                        len(self.encoded) >= self.depth * self.workers):
+                    self.cond.wait(0.5)
+                    continue
+
+                # Marked in flight before the lock is let go, so no
+                # later frame can be sent ahead of it meanwhile.
+                item = self.captured.get(0.5)
+
+                if item is not None:
+                    self.inflight.add(item[0])
+
+            if item is None:
+                continue
+
+            seq, image = item
+
+            try:
+                encoded = self.segment.encode(image)
+
+            except Exception as error:
+                logging.error(error)
+                encoded = None
+
+            with self.cond:
+                self.inflight.discard(seq)
+
+                if encoded is not None:
+                    heappush(self.encoded, (seq, encoded))
+
+                    if self.intra and (
+                            len(self.encoded) > self.depth * self.workers):
+                        heappop(self.encoded)
+                        self.dropped += 1
+
+                self.cond.notify_all()
+
+    def next_encoded(self):
+        """Wait for the oldest frame no earlier frame is still behind."""
+        with self.cond:
+            while self.running:
+                if self.encoded and (
+                        not self.inflight
+                        or self.encoded[0][0] < min(self.inflight)):
+                    # Wakes an encoder waiting for room.
+                    self.cond.notify_all()
+                    return heappop(self.encoded)
+
+                self.cond.wait(0.5)
+
+        return None, None
+
+    def sender(self):
+        while self.running:
+            seq, encoded = self.next_encoded()
+
+            if seq is None:
+                continue
+
+            if seq <= self.last_sent:
+                self.late += 1
+                continue
+
+            try:
+                self.segment.send_frame(*encoded)
+
+            except OSError as error:
+                logging.error(error)
+                continue
+
+            self.last_sent = seq
+            self.sent += 1
+
+    def metrics(self):
+        labels = {"stream": self.segment.stream}
+        yield "frames_submitted_total", labels, self.seq
+        yield "queue_depth", {**labels, "queue": "capture"}, len(
+            self.captured)
+        yield "queue_depth", {**labels, "queue": "encode"}, len(
+            self.inflight)
+        yield "queue_depth", {**labels, "queue": "send"}, len(self.encoded)
+
+        for reason, count in (
+                ("capture_queue", self.captured.dropped),
+                ("send_queue", self.dropped), ("out_of_order", self.late)):
+            yield "frames_dropped_total", {**labels, "reason": reason}, count
+
+        yield from self.segment.metrics()
+
+    def depths(self):
+        """Queue depth and drops of each stage."""
+        return {
+            "capture": len(self.captured),
+            "encode": len(self.inflight),
+            "send": len(self.encoded),
+            "dropped": self.captured.dropped + self.dropped + self.late,
+        }
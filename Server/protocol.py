@@ -0,0 +1,210 @@
+# coding: utf-8
+"""
+Wire format shared by the sender and the receiver.
+
+Every datagram starts with a fixed header followed by one slice
+of the encoded frame. Keep this file identical in Server/ and Client/.
+"""
+import struct
+
+VERSION = 6
+
+# version, flags, stream id, frame id, segment index, segment total,
+# payload length, payload offset within the frame, frame size, FEC data
+# and parity segments per group, capture time in microseconds of the
+# sender's monotonic clock
+HEADER = struct.Struct("!BBBIHHHIIBBI")
+HEADER_SIZE = HEADER.size
+
+MAX_DGRAM = 2 ** 16
+MAX_IMAGE_DGRAM = MAX_DGRAM - 64 - HEADER_SIZE
+
+# Keeps header + payload under a 1500 byte MTU (1472 bytes of UDP
+# payload), so the kernel never has to fragment a datagram.
+PAYLOAD_SIZE = 1400
+
+# Largest frame a receiver allocates room for, far above any JPEG or
+# H.264 frame of the camera, so a bad header cannot exhaust memory.
+MAX_FRAME_SIZE = 16 * 2 ** 20
+
+FRAME_ID_MASK = 0xFFFFFFFF
+# Capture times wrap around every 71 minutes.
+TIME_MASK = 0xFFFFFFFF
+
+FLAG_PARITY = 0x01
+FLAG_H264 = 0x02
+FLAG_KEYFRAME = 0x04
+FLAG_TILES = 0x08
+# Simulcast layer of a frame, each layer is half the size of the one
+# before it.
+LAYER_MASK = 0x30
+LAYER_SHIFT = 4
+LAYERS = 1 + (LAYER_MASK >> LAYER_SHIFT)
+FLAG_SUBSCRIBE = 0x40
+FLAG_FEEDBACK = 0x80
+# Both control bits: a clock ping from a receiver, or the sender's pong.
+FLAG_CLOCK = FLAG_SUBSCRIBE | FLAG_FEEDBACK
+
+# Payload of a FLAG_TILES frame: picture width, height and tile count,
+# then per tile its x, y, width, height and JPEG length before the JPEG.
+TILES = struct.Struct("!HHH")
+TILE = struct.Struct("!HHHHI")
+
+# version, flags, layer; a receiver's heartbeat asking for the stream
+SUBSCRIBE = struct.Struct("!BBB")
+
+# version, flags, segment loss in 1/10000, late frames,
+# decode time in microseconds, received bytes per second
+FEEDBACK = struct.Struct("!BBHHII")
+
+# version, flags, receiver's time of the ping and sender's time of the
+# pong in microseconds of their monotonic clocks
+CLOCK = struct.Struct("!BBQQ")
+
+
+def pack_header(frame_id, index, total, length, offset, size, flags=0,
+                fec=(0, 0), stream=0, captured=0.0):
+    """
+    Build the header for one segment of a frame. Parity segments
+    (FLAG_PARITY) number their index separately from data segments.
+    """
+    return HEADER.pack(
+        VERSION, flags, stream, frame_id & FRAME_ID_MASK,
+        index, total, length, offset, size, *fec, timestamp(captured))
+
+
+def unpack_header(data):
+    """
+    Return (flags, frame_id, index, total, length,
+    offset, size, fec, captured) of a datagram.
+    """
+    if len(data) < HEADER_SIZE:
+        raise ValueError(f"Datagram too short ({len(data)} bytes)")
+
+    (version, flags, _, frame_id, index, total,
+     length, offset, size, fec_n, fec_k, captured) = HEADER.unpack_from(data)
+
+    if version != VERSION:
+        raise ValueError(f"Unsupported protocol version {version}")
+
+    if flags & (FLAG_FEEDBACK | FLAG_SUBSCRIBE):
+        raise ValueError("Control datagram where a segment was expected")
+
+    if HEADER_SIZE + length > len(data):
+        raise ValueError(f"Truncated segment in frame {frame_id}")
+
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame {frame_id} too large ({size} bytes)")
+
+    if flags & FLAG_PARITY:
+        if not fec_n or not fec_k or index >= fec_groups(total, fec_n) * fec_k:
+            raise ValueError(f"Bad parity {index} in frame {frame_id}")
+
+    elif not total or index >= total:
+        raise ValueError(f"Bad segment {index}/{total} in frame {frame_id}")
+
+    elif offset + length > size:
+        raise ValueError(f"Segment outside of frame {frame_id}")
+
+    return (
+        flags, frame_id, index, total, length, offset, size, (fec_n, fec_k),
+        captured)
+
+
+def stream_of(data):
+    """Stream id of a segment, so it can go to its camera's reassembler."""
+    if len(data) < HEADER_SIZE:
+        raise ValueError(f"Datagram too short ({len(data)} bytes)")
+
+    return data[2]
+
+
+def fec_groups(total, fec_n):
+    """Number of FEC groups covering total data segments."""
+    return -(-total // fec_n)
+
+
+def is_newer(frame_id, other):
+    """Compare frame ids while allowing them to wrap around."""
+    return 0 < ((frame_id - other) & FRAME_ID_MASK) < FRAME_ID_MASK // 2
+
+
+def timestamp(seconds):
+    """Header capture time of a monotonic clock reading."""
+    return int(seconds * 1e6) & TIME_MASK
+
+
+def age(stamp, now):
+    """Seconds from a header capture time to now, on the same clock."""
+    elapsed = (timestamp(now) - stamp) & TIME_MASK
+
+    if elapsed > TIME_MASK // 2:
+        elapsed -= TIME_MASK + 1
+
+    return elapsed / 1e6
+
+
+def pack_feedback(loss, late, decode_time, rate):
+    """Build a receiver report, loss as a ratio, decode time in seconds."""
+    return FEEDBACK.pack(
+        VERSION, FLAG_FEEDBACK,
+        min(int(loss * 10000), 10000), min(late, 0xFFFF),
+        min(int(decode_time * 1e6), 0xFFFFFFFF), min(int(rate), 0xFFFFFFFF))
+
+
+def unpack_feedback(data):
+    """Return (loss, late, decode_time, rate) of a receiver report."""
+    if len(data) < FEEDBACK.size:
+        raise ValueError(f"Feedback too short ({len(data)} bytes)")
+
+    version, flags, loss, late, decode_time, rate = FEEDBACK.unpack_from(data)
+
+    if version != VERSION or flags != FLAG_FEEDBACK:
+        raise ValueError("Not a feedback datagram")
+
+    return loss / 10000, late, decode_time / 1e6, rate
+
+
+def layer_of(flags):
+    """Simulcast layer a frame belongs to, 0 is full size."""
+    return (flags & LAYER_MASK) >> LAYER_SHIFT
+
+
+def pack_subscribe(layer=0):
+    """Build the heartbeat a receiver sends to keep getting frames."""
+    return SUBSCRIBE.pack(VERSION, FLAG_SUBSCRIBE, layer)
+
+
+def unpack_subscribe(data):
+    """Return the layer a receiver's heartbeat asks for."""
+    if len(data) < SUBSCRIBE.size:
+        raise ValueError(f"Subscription too short ({len(data)} bytes)")
+
+    return min(SUBSCRIBE.unpack_from(data)[2], LAYERS - 1)
+
+
+def pack_clock(pinged, ponged=0.0):
+    """Build a clock ping (pinged only) or pong, times in seconds."""
+    return CLOCK.pack(
+        VERSION, FLAG_CLOCK, int(pinged * 1e6), int(ponged * 1e6))
+
+
+def unpack_clock(data):
+    """Return (pinged, ponged) of a clock ping or pong, in seconds."""
+    if len(data) < CLOCK.size:
+        raise ValueError(f"Clock datagram too short ({len(data)} bytes)")
+
+    _, _, pinged, ponged = CLOCK.unpack_from(data)
+
+    return pinged / 1e6, ponged / 1e6
+
+
+def control_flags(data):
+    """
+    Kind of a control datagram, FLAG_SUBSCRIBE, FLAG_FEEDBACK
+    or FLAG_CLOCK, or 0 if it is a segment.
+    """
+    if len(data) < SUBSCRIBE.size or data[0] != VERSION:
+        return 0
+
+    return data[1] & FLAG_CLOCK
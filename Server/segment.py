@@ -0,0 +1,242 @@
+# coding: utf-8
+from __future__ import division
+
+from concurrent.futures import ThreadPoolExecutor
+from ipaddress import ip_address
+from math import ceil
+from socket import IP_MULTICAST_TTL, IPPROTO_IP
+from time import perf_counter
+
+from numpy import bitwise_xor, empty, frombuffer, uint8, zeros
+
+from codec import create_encoder, scaled
+from fanout import Subscribers
+from metrics import SIZE_BUCKETS, Histogram
+from protocol import (FLAG_KEYFRAME, FLAG_PARITY, LAYER_SHIFT, LAYERS,
+                      MAX_IMAGE_DGRAM, PAYLOAD_SIZE, fec_groups, pack_header)
+from sockets import resolve
+from source import SourceFrame
+
+
+def is_multicast(addr):
+    """Whether addr is a multicast group, host names never are."""
+    try:
+        return ip_address(addr).is_multicast
+
+    except ValueError:
+        return False
+
+
+def xor_parity(dat, total, payload, fec_n, fec_k):
+    """
+    Parity block j of each group is the XOR of the data segments
+    j, j + k, j + 2k, .. of that group, zero padded to payload.
+    """
+    groups = fec_groups(total, fec_n)
+    blocks = zeros(groups * fec_n * payload, dtype=uint8)
+    blocks[:len(dat)] = frombuffer(dat, dtype=uint8)
+    blocks = blocks.reshape(groups, fec_n, payload)
+    parity = empty((groups, fec_k, payload), dtype=uint8)
+
+    for j in range(fec_k):
+        bitwise_xor.reduce(blocks[:, j::fec_k], axis=1, out=parity[:, j])
+
+    return parity
+
+
+def packetize(frame_id, dat, payload, fec=None, flags=0, stream=0,
+              captured=0.0):
+    """
+    Yield the [header, payload] buffers of each datagram of a frame,
+    with fec=(n, k) every n data segments are followed by k parity ones.
+    """
+    view = memoryview(dat)
+    size = len(dat)
+    payload = min(payload, size)
+    total = ceil(size / payload) if size else 0
+    fec_n, fec_k = fec if fec else (0, 0)
+    parity = xor_parity(dat, total, payload, fec_n, fec_k) if fec_k else None
+
+    for index in range(total):
+        start = index * payload
+        end = min(size, start + payload)
+        yield [
+            pack_header(
+                frame_id, index, total, end - start, start, size,
+                flags, (fec_n, fec_k), stream, captured),
+            view[start:end]]
+
+        if parity is not None and (
+                (index + 1) % fec_n == 0 or index + 1 == total):
+            group = index // fec_n
+
+            for j in range(fec_k):
+                yield [
+                    pack_header(
+                        frame_id, group * fec_k + j, total, payload, 0, size,
+                        flags | FLAG_PARITY, (fec_n, fec_k), stream,
+                        captured),
+                    parity[group, j]]
+
+
+class FrameSegment:
+    """
+    Object to break down image frame segment
+    if the size of image exceed the payload size
+    """
+    MAX_IMAGE_DGRAM = MAX_IMAGE_DGRAM
+
+    def __init__(self, sock, port, addr, quality, payload=PAYLOAD_SIZE,
+                 fec=None, codec="mjpeg", framerate=35, subscribers=None,
+                 stream=0, layers=1, subsampling="420"):
+        self.s = sock
+        self.port = port
+        # A receiver, a multicast group, or None to only send
+        # to the receivers that subscribed.
+        self.addr = addr
+        # Resolved, so a subscription from it is recognised.
+        self.fixed = resolve((addr, port)) if addr is not None else None
+        self.subscribers = (
+            Subscribers() if subscribers is None else subscribers)
+        self.quality = quality
+        # Simulcast: layer i is the picture downscaled by 2 ** i,
+        # each with its own encoder.
+        self.encoders = [
+            create_encoder(codec, framerate, subsampling)
+            for _ in range(max(1, min(layers, LAYERS)))]
+        self.pool = (
+            ThreadPoolExecutor(max_workers=len(self.encoders))
+            if len(self.encoders) > 1 else None)
+        self.payload = min(payload, self.MAX_IMAGE_DGRAM)
+        # (data, parity) segments per group, e.g. (10, 1) for 10% overhead.
+        self.fec = fec
+        self.scale = 1.0
+        # Whether the last frame went out as the camera encoded it,
+        # where the quality has no effect.
+        self.passthrough = False
+        # Tells this camera apart at a receiver showing several.
+        self.stream = stream
+        self.frame_id = 0
+        self.bytes_sent = 0
+        self.encode_time = Histogram()
+        self.frame_bytes = Histogram(SIZE_BUCKETS)
+
+        if addr is not None and is_multicast(addr):
+            self.s.setsockopt(IPPROTO_IP, IP_MULTICAST_TTL, 1)
+
+    def udp_frame(self, img):
+        """
+        Compress image and Break down
+        into data segments
+        """
+        self.send_frame(*self.encode(img))
+
+    def set_quality(self, quality, scale=1.0):
+        """Change JPEG quality and downscale factor of the next frames."""
+        self.quality = quality
+        self.scale = scale
+
+    def encode(self, img):
+        """
+        Compress an image or SourceFrame into each layer somebody
+        receives, return a (bytes, flags) or None per layer and the
+        capture time.
+        """
+        start = perf_counter()
+        frame = img if isinstance(img, SourceFrame) else SourceFrame(img)
+        wanted = [bool(routes) for routes in self.destinations()]
+        wanted[0] = wanted[0] or not any(wanted)
+        deepest = max(i for i, w in enumerate(wanted) if w)
+        # A JPEG from the camera is scaled down while it is decoded,
+        # pixels are downscaled layer by layer, never from the full
+        # picture again.
+        direct = frame.jpeg is not None and self.scale == 1.0
+        self.passthrough = direct and self.encoders[0].passthrough
+        images = []
+
+        if not direct:
+            images.append(scaled(frame.array(), self.scale))
+
+            for _ in range(deepest):
+                images.append(scaled(images[-1], 0.5))
+
+        def encode_layer(layer):
+            if layer > deepest or not wanted[layer]:
+                return None
+
+            encoder = self.encoders[layer]
+
+            if direct and layer == 0 and encoder.passthrough:
+                # Sent as the camera encoded it, the quality the
+                # controller picks only applies once it scales down.
+                return frame.jpeg, FLAG_KEYFRAME
+
+            dat, flags = encoder.encode(
+                frame.array(2 ** layer) if direct else images[layer],
+                self.quality)
+            return dat, flags | layer << LAYER_SHIFT
+
+        if self.pool is None:
+            layers = [encode_layer(0)]
+
+        else:
+            layers = list(self.pool.map(
+                encode_layer, range(len(self.encoders))))
+
+        self.encode_time.observe(perf_counter() - start)
+
+        return layers, frame.captured
+
+    def destinations(self):
+        """
+        Receivers of each layer: the fixed address gets the full
+        picture until it subscribes itself, subscribers the layer they
+        asked for or the smallest.
+        """
+        routes = [[] for _ in self.encoders]
+        active = self.subscribers.active()
+
+        if self.fixed is not None and self.fixed not in active:
+            routes[0].append(self.fixed)
+
+        for addr in active:
+            layer = min(self.subscribers.layer(addr), len(routes) - 1)
+            routes[layer].append(addr)
+
+        return routes
+
+    def send_frame(self, layers, captured=0.0):
+        """Send the encoded layers of a frame as numbered segments."""
+        try:
+            for encoded, destinations in zip(layers, self.destinations()):
+                if encoded is None or not destinations:
+                    continue
+
+                dat, flags = encoded
+
+                for buffers in packetize(
+                        self.frame_id, dat, self.payload, self.fec, flags,
+                        self.stream, captured):
+                    # Scatter-gather, header and payload are never
+                    # concatenated, and the same buffers go to every
+                    # destination.
+                    for destination in destinations:
+                        self.s.sendmsg(buffers, (), 0, destination)
+
+                self.bytes_sent += len(dat)
+                self.frame_bytes.observe(len(dat))
+
+        finally:
+            # Layers of one capture share its frame id, a frame that
+            # failed to send leaves a gap inter-frame decoders notice.
+            self.frame_id += 1
+
+    def metrics(self):
+        labels = {"stream": self.stream}
+        yield "frames_sent_total", labels, self.frame_id
+        yield "bytes_sent_total", labels, self.bytes_sent
+        yield "encode_seconds", labels, self.encode_time
+        yield "frame_bytes", labels, self.frame_bytes
+        yield "quality", labels, self.quality
+        yield "scale", labels, self.scale
+        yield "subscribers", labels, len(self.subscribers)
@@ -2,21 +2,26 @@
 # coding: utf-8
 from __future__ import division
 
-import struct
 import subprocess
 from datetime import datetime
 from io import BytesIO
-from math import ceil
 from socket import AF_INET, SOCK_DGRAM, socket
 from threading import Thread
 
-from cv2 import IMWRITE_JPEG_QUALITY, imencode
+from cv2 import imencode
 from paramiko import SSHClient, WarningPolicy
 from picamera import PiCamera
-from picamera.array import PiRGBArray
 from telegram import Bot, ChatAction, ParseMode, Update
 from telegram.ext import CallbackContext, CommandHandler, Updater
 
+import metrics
+from control import QualityController
+from motion import MotionGate
+from pipeline import Pipeline
+from segment import FrameSegment
+from sockets import set_buffers
+from source import CameraArrays, CameraMjpeg
+
 
 def helps(update: Update, context: CallbackContext) -> None:
     """Send a message when the command /help is issued."""
@@ -120,55 +125,53 @@ def status(update: Update, context: CallbackContext) -> None:
     global stop_instance, is_not_running
 
     state = 'is off' if is_not_running else 'is on'
-    update.message.reply_text(f"The camera {state}.")
-
-
-class FrameSegment:
-    """
-    Object to break down image frame segment
-    if the size of image exceed maximum datagram size
-    """
-    MAX_DGRAM = 2**16
-    MAX_IMAGE_DGRAM = MAX_DGRAM - 64
-
-    def __init__(self, sock, port, addr, quality):
-        self.s = sock
-        self.port = port
-        self.addr = addr
-        self.quality = [int(IMWRITE_JPEG_QUALITY), quality]
-
-    def udp_frame(self, img):
-        """
-        Compress image and Break down
-        into data segments
-        """
-        compress_img = imencode(
-            '.jpg', img, self.quality)[1]
-        dat = compress_img.tobytes()
-        size = len(dat)
-        count = ceil(size / (self.MAX_IMAGE_DGRAM))
-        array_pos_start = 0
-        while count:
-            array_pos_end = min(size, array_pos_start + self.MAX_IMAGE_DGRAM)
-            self.s.sendto(
-                struct.pack("B", count) + dat[array_pos_start: array_pos_end],
-                (self.addr, self.port)
-            )
-            array_pos_start = array_pos_end
-            count -= 1
+    message = f"The camera {state}."
+
+    if pipeline is not None and not is_not_running:
+        depths = pipeline.depths()
+        message += (
+            f"\nQueues: capture {depths['capture']}, "
+            f"encode {depths['encode']}, send {depths['send']}, "
+            f"{depths['dropped']} frames dropped.\n"
+            f"Quality {pipeline.segment.quality} "
+            f"at scale {pipeline.segment.scale}.\n"
+            f"Scene is {'still' if gate.idle() else 'moving'}, "
+            f"motion check takes {gate.cost * 1000:.2f} ms.\n"
+            f"{len(pipeline.segment.subscribers)} subscribers.")
+
+    update.message.reply_text(message)
 
 
 def cam_runner():
     global is_not_running, stop_instance, bot, bot_settings
-    global send_picture
+    global send_picture, pipeline, gate
 
     with PiCamera() as camera:
         camera.resolution = (1280, 720)
         camera.framerate = 35
-        rawCapture = PiRGBArray(
-            camera, size=camera.resolution)
         remote = '192.168.1.13'
         port = 6666
+        # Further receivers subscribe with heartbeats to this port.
+        subscribe_port = 6667
+        # Tells this camera apart when a receiver shows several.
+        stream_id = 0
+        # Kernel send buffer in bytes, a whole frame of segments fits
+        # so sendmsg rarely blocks; net.core.wmem_max caps it.
+        send_buffer = 1024 * 1024
+        # Scraped from this host by Prometheus or read as JSON, see
+        # http://localhost:6680/metrics and /metrics.json, clear of the
+        # exporters' 91xx ports.
+        metrics_port = 6680
+        # Simulcast layers, each half the size of the one before, for
+        # receivers with small screens to subscribe to.
+        layers = 1
+        # 'h264' needs PyAV and saves bandwidth on still scenes,
+        # 'tiles' only sends the parts of the picture that changed,
+        # 'mjpeg' has the lowest latency.
+        codec = 'mjpeg'
+        # The camera's hardware encodes MJPEG that is sent as it is,
+        # with no raw copy and no software encode per frame.
+        camera_jpeg = codec == 'mjpeg'
 
         x = 'x'.join([str(v) for v in camera.resolution])
         channel = bot_settings.get('channel')
@@ -176,9 +179,12 @@ def cam_runner():
             chat_id=channel,
             text=(
                 f"The <b>camera</b> is ready to be used.\n"
-                f"Remote flow: <b>{remote}:{port}</b>\n"
+                f"Remote flow: <b>{remote}:{port}</b>"
+                f" as stream <b>{stream_id}</b>\n"
+                f"Subscriptions on port <b>{subscribe_port}</b>\n"
                 f"with <b>{camera.framerate}</b> FPS/Sec.\n"
-                f"Picture size is <b>{x}</b>.\n"),
+                f"Picture size is <b>{x}</b>.\n"
+                f"Codec is <b>{codec}</b>.\n"),
             parse_mode=ParseMode.HTML)
 
         print(f"Pushing data to {remote}:{port}")
@@ -186,16 +192,31 @@ def cam_runner():
         print(f"Picture size is {x}")
 
         s = socket(AF_INET, SOCK_DGRAM)
-        fs = FrameSegment(s, port, remote, quality=45)
-
-        for frame in camera.capture_continuous(
-            rawCapture,
-            format="bgr",
-            use_video_port=True
-        ):
-            image = frame.array
-            fs.udp_frame(image)
-            rawCapture.truncate(0)
+        s.bind(("0.0.0.0", subscribe_port))
+        set_buffers(s, send=send_buffer)
+        fs = FrameSegment(
+            s, port, remote, quality=60, fec=(10, 1),
+            codec=codec, framerate=int(camera.framerate), stream=stream_id,
+            layers=layers)
+        pipeline = Pipeline(fs, workers=3, depth=2)
+        pipeline.start()
+        controller = QualityController(fs, camera.framerate)
+        controller.start()
+        # Still scenes only send one frame a second. Motion is judged
+        # on a quarter size picture, cheap to decode from a JPEG, and
+        # the gate times that decode against its budget.
+        gate = MotionGate(idle_interval=1.0, step=2, reduction=4)
+        source = (
+            CameraMjpeg(camera, quality=60) if camera_jpeg
+            else CameraArrays(camera))
+        metrics.registry.register(pipeline.metrics)
+        metrics.registry.register(gate.metrics)
+        server = metrics.serve(metrics.registry, metrics_port)
+
+        for frame in source:
+            if gate.should_send(frame):
+                pipeline.submit(frame)
+
             is_not_running = False
 
             if stop_instance:
@@ -207,9 +228,17 @@ def cam_runner():
                 send_picture = False
                 Thread(
                     target=transfer_picture,
-                    args=(image, channel, )
+                    args=(frame.array(), channel, )
                 ).start()
 
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+        metrics.registry.unregister(pipeline.metrics)
+        metrics.registry.unregister(gate.metrics)
+        pipeline.stop()
+        controller.stop()
         s.close()
 
 
@@ -217,6 +246,8 @@ if __name__ == "__main__":
     send_picture = False
     stop_instance = False
     is_not_running = False
+    pipeline = None
+    gate = None
 
     bot_settings = {
         "token": "blablablaaaaaaaaaa",
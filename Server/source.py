@@ -0,0 +1,130 @@
+# coding: utf-8
+"""
+Frame sources. A source yields SourceFrames holding either raw BGR
+pixels or a JPEG that is already encoded, which the MJPEG codec sends
+as it is; pixels are only decoded from it when somebody needs them.
+"""
+from io import BytesIO
+from itertools import cycle
+from time import monotonic
+
+from cv2 import imdecode
+from numpy import frombuffer, uint8
+
+from jpeg import REDUCTIONS
+from pipeline import DropQueue
+
+try:
+    from picamera.array import PiRGBArray
+
+except ImportError:
+    PiRGBArray = None
+
+
+class SourceFrame:
+    """
+    One captured frame, as BGR pixels, as a JPEG, or both
+    """
+    __slots__ = ("jpeg", "image", "arrays", "captured")
+
+    def __init__(self, image=None, jpeg=None, captured=None):
+        self.image = image
+        self.jpeg = jpeg
+        self.arrays = {}
+        # Monotonic time of the capture, sent along to measure latency.
+        self.captured = monotonic() if captured is None else captured
+
+    def array(self, reduction=1):
+        """BGR pixels at 1/reduction of the size, decoded once if needed."""
+        if self.image is not None:
+            return self.image[::reduction, ::reduction] if (
+                reduction > 1) else self.image
+
+        if reduction not in self.arrays:
+            # Decoding at a reduced size is cheaper than downscaling.
+            self.arrays[reduction] = imdecode(
+                frombuffer(self.jpeg, dtype=uint8), REDUCTIONS[reduction])
+
+        return self.arrays[reduction]
+
+
+class CameraArrays:
+    """
+    Raw BGR arrays from the camera's video port, encoded by us
+    """
+
+    def __init__(self, camera):
+        self.camera = camera
+
+    def __iter__(self):
+        raw = PiRGBArray(self.camera, size=self.camera.resolution)
+
+        for frame in self.camera.capture_continuous(
+                raw, format="bgr", use_video_port=True):
+            yield SourceFrame(frame.array)
+            raw.truncate(0)
+
+
+class _MjpegOutput:
+    """
+    File-like object the camera records MJPEG into, one frame at a time
+    """
+
+    def __init__(self, camera, depth):
+        self.camera = camera
+        self.buffer = BytesIO()
+        self.frames = DropQueue(depth)
+
+    def write(self, data):
+        written = self.buffer.write(data)
+
+        if self.camera.frame.complete:
+            self.frames.put(self.buffer.getvalue())
+            self.buffer.seek(0)
+            self.buffer.truncate()
+
+        return written
+
+    def flush(self):
+        pass
+
+
+class CameraMjpeg:
+    """
+    JPEG frames from the camera's hardware MJPEG encoder on the video
+    port, no raw copy and no software encode per frame
+    """
+
+    def __init__(self, camera, quality=60, depth=2):
+        self.camera = camera
+        self.quality = quality
+        self.depth = depth
+
+    def __iter__(self):
+        output = _MjpegOutput(self.camera, self.depth)
+        self.camera.start_recording(
+            output, format="mjpeg", quality=self.quality)
+
+        try:
+            while True:
+                jpeg = output.frames.get(1.0)
+
+                if jpeg is not None:
+                    yield SourceFrame(jpeg=jpeg)
+
+        finally:
+            self.camera.stop_recording()
+
+
+class JpegFrames:
+    """
+    Loop over JPEGs encoded beforehand, the pass-through path
+    without a camera
+    """
+
+    def __init__(self, jpegs):
+        self.jpegs = list(jpegs)
+
+    def __iter__(self):
+        for jpeg in cycle(self.jpegs):
+            yield SourceFrame(jpeg=jpeg)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+JPEG decode time per frame at each reduction the receiver picks
+from the widget size: full size, 1/2, 1/4 and 1/8.
+"""
+import argparse
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+from cv2 import (CAP_PROP_FRAME_COUNT, IMWRITE_JPEG_QUALITY, INTER_AREA,
+                 VideoCapture, circle, imencode, resize)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "Client"))
+
+from codec import MjpegDecoder  # noqa: E402
+from jpeg import REDUCTIONS, probe  # noqa: E402
+
+
+def synthetic(count, width, height):
+    """Frames with gradients, edges and some noise, like a camera's."""
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    frames = []
+
+    for i in range(count):
+        image = np.empty((height, width, 3), dtype=np.uint8)
+        image[..., 0] = (x + i * 3) % 256
+        image[..., 1] = y
+        image[..., 2] = (x[::-1] + y) / 2
+
+        for _ in range(20):
+            circle(
+                image,
+                (int(rng.integers(width)), int(rng.integers(height))),
+                int(rng.integers(10, height // 4)),
+                [int(c) for c in rng.integers(0, 256, 3)], -1)
+
+        noise = rng.integers(-8, 9, image.shape)
+        frames.append(np.clip(image + noise, 0, 255).astype(np.uint8))
+
+    return frames
+
+
+def from_video(path, count, width, height):
+    capture = VideoCapture(path)
+    total = int(capture.get(CAP_PROP_FRAME_COUNT)) or count
+    step = max(1, total // count)
+    frames = []
+
+    while len(frames) < count:
+        for _ in range(step):
+            ok, image = capture.read()
+
+        if not ok:
+            break
+
+        frames.append(
+            resize(image, (width, height), interpolation=INTER_AREA))
+
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--quality", type=int, default=60)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--video", help="take sample frames from a video")
+    parser.add_argument("--backend", choices=("opencv", "turbojpeg"))
+    args = parser.parse_args()
+
+    if args.video:
+        frames = from_video(args.video, args.frames, args.width, args.height)
+
+    else:
+        frames = synthetic(args.frames, args.width, args.height)
+
+    jpegs = [
+        imencode(".jpg", image, [int(IMWRITE_JPEG_QUALITY), args.quality])[1]
+        .tobytes() for image in frames]
+    decoder = MjpegDecoder(probe(args.backend))
+    print(f"{len(jpegs)} frames of {args.width}x{args.height}, "
+          f"{sum(map(len, jpegs)) // len(jpegs)} bytes each, "
+          f"decoded with {decoder.jpeg.name}")
+    full = None
+
+    for reduction in REDUCTIONS:
+        start = perf_counter()
+
+        for _ in range(args.rounds):
+            for frame_id, jpeg in enumerate(jpegs):
+                image = decoder.decode(jpeg, frame_id, 0, reduction)
+
+        elapsed = (perf_counter() - start) / (args.rounds * len(jpegs))
+        full = elapsed if full is None else full
+        print(f"  1/{reduction}: {image.shape[1]:>4}x{image.shape[0]:<4} "
+              f"{elapsed * 1000:7.3f} ms/frame, "
+              f"{full / elapsed:5.2f}x faster")
+
+
+if __name__ == "__main__":
+    main()
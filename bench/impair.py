@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+UDP proxy between a sender and a receiver on localhost that makes
+the link bad on purpose: random and burst loss, reordering,
+duplication, delay with jitter and a bandwidth cap, all drawn from
+a seeded generator so runs can be repeated. Every datagram is logged
+with what was done to it; reports from the receiver go back to the
+sender untouched, and the sender's clock replies to the receiver.
+"""
+import argparse
+import json
+import os
+import random
+import struct
+import sys
+from collections import Counter
+from heapq import heappop, heappush
+from socket import AF_INET, SOCK_DGRAM, socket
+from socket import timeout as TimeoutException
+from time import monotonic
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "Server"))
+
+from protocol import (FLAG_PARITY, HEADER, MAX_DGRAM,  # noqa: E402
+                      control_flags)
+
+
+class Impairment:
+    """
+    What the simulated link does to each datagram, loss bursts follow
+    a two-state (Gilbert-Elliott) model
+    """
+
+    def __init__(self, loss=0.0, burst=0.0, burst_length=3.0, reorder=0.0,
+                 reorder_delay=0.01, duplicate=0.0, delay=0.0, jitter=0.0,
+                 rate=0.0, queue=64_000, seed=1):
+        self.loss = loss
+        # Chance per datagram of a burst starting, and its mean length.
+        self.burst = burst
+        self.burst_length = max(1.0, burst_length)
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.duplicate = duplicate
+        self.delay = delay
+        self.jitter = jitter
+        # Bits per second, with at most queue bytes waiting for the link.
+        self.rate = rate
+        self.queue = queue
+        self.rng = random.Random(seed)
+        self.bursting = False
+        self.link_free = 0.0
+        self.counts = Counter()
+
+    @property
+    def active(self):
+        return any((
+            self.loss, self.burst, self.reorder, self.duplicate,
+            self.delay, self.jitter, self.rate))
+
+    def apply(self, size, now):
+        """Return (release times, what was done) for a datagram."""
+        rng = self.rng
+        self.counts["datagrams"] += 1
+
+        if self.burst:
+            if self.bursting:
+                self.bursting = rng.random() >= 1 / self.burst_length
+
+            else:
+                self.bursting = rng.random() < self.burst
+
+            if self.bursting:
+                self.counts["burst"] += 1
+                return [], ["burst"]
+
+        if self.loss and rng.random() < self.loss:
+            self.counts["loss"] += 1
+            return [], ["loss"]
+
+        due = now
+        actions = []
+
+        if self.rate:
+            start = max(now, self.link_free)
+
+            if (start - now) * self.rate / 8 > self.queue:
+                self.counts["queue"] += 1
+                return [], ["queue"]
+
+            self.link_free = start + size * 8 / self.rate
+            due = self.link_free
+
+            if start > now:
+                actions.append("queued")
+
+        if self.delay or self.jitter:
+            due += max(0.0, self.delay + rng.uniform(
+                -self.jitter, self.jitter))
+
+        if self.reorder and rng.random() < self.reorder:
+            due += self.reorder_delay
+            actions.append("reorder")
+
+        times = [due]
+
+        if self.duplicate and rng.random() < self.duplicate:
+            times.append(due)
+            actions.append("duplicate")
+
+        for action in actions:
+            self.counts[action] += 1
+
+        return times, actions or ["forward"]
+
+
+def describe(data):
+    """Frame id, segment index and parity of a datagram, for the log."""
+    try:
+        fields = HEADER.unpack_from(data)
+
+    except struct.error:
+        return {}
+
+    return {
+        "frame": fields[3], "index": fields[4],
+        "parity": bool(fields[1] & FLAG_PARITY)}
+
+
+def proxy(sock, forward, impairment, log=None):
+    """Forward datagrams to forward through the impairment until closed."""
+    buffer = memoryview(bytearray(MAX_DGRAM))
+    pending = []
+    started = monotonic()
+    source = None
+    seq = 0
+
+    while True:
+        now = monotonic()
+
+        try:
+            while pending and pending[0][0] <= now:
+                sock.sendto(heappop(pending)[2], forward)
+
+            sock.settimeout(
+                max(0.0005, pending[0][0] - now) if pending else 0.1)
+            size, addr = sock.recvfrom_into(buffer)
+
+        except TimeoutException:
+            continue
+
+        except OSError:
+            break
+
+        now = monotonic()
+        data = bytes(buffer[:size])
+
+        if control_flags(data):
+            # Subscriptions, feedback and clock pings go back to the
+            # sender as they are, its clock pongs to the receiver.
+            if addr == source:
+                sock.sendto(data, forward)
+
+            elif source is not None:
+                sock.sendto(data, source)
+            continue
+
+        source = addr
+        times, actions = impairment.apply(size, now)
+
+        for due in times:
+            heappush(pending, (due, seq, data))
+            seq += 1
+
+        if log is not None:
+            log.write(json.dumps({
+                "t": round(now - started, 6), "size": size,
+                **describe(data), "actions": actions,
+                "delay_ms": round((times[0] - now) * 1000, 3)
+                if times else None}) + "\n")
+
+
+def add_arguments(parser):
+    """Impairment options, shared with the benchmarks."""
+    group = parser.add_argument_group("impairment")
+    group.add_argument("--loss", type=float, default=0.0)
+    group.add_argument(
+        "--burst", type=float, default=0.0,
+        help="chance per datagram of a loss burst starting")
+    group.add_argument(
+        "--burst-length", type=float, default=3.0,
+        help="mean datagrams lost per burst")
+    group.add_argument("--reorder", type=float, default=0.0)
+    group.add_argument(
+        "--reorder-delay", type=float, default=10.0,
+        help="ms a reordered datagram is held back")
+    group.add_argument("--duplicate", type=float, default=0.0)
+    group.add_argument("--delay", type=float, default=0.0, help="ms")
+    group.add_argument("--jitter", type=float, default=0.0, help="+/- ms")
+    group.add_argument(
+        "--rate", type=float, default=0.0, help="link bits/s, 0 unlimited")
+    group.add_argument(
+        "--queue", type=int, default=64_000,
+        help="bytes waiting for the link before datagrams are dropped")
+    group.add_argument("--seed", type=int, default=1)
+
+
+def from_arguments(args):
+    return Impairment(
+        args.loss, args.burst, args.burst_length, args.reorder,
+        args.reorder_delay / 1000, args.duplicate, args.delay / 1000,
+        args.jitter / 1000, args.rate, args.queue, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--listen", type=int, default=6665)
+    parser.add_argument("--forward", default="127.0.0.1:6666")
+    parser.add_argument("--log", help="JSON lines, one per datagram")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    host, port = args.forward.rsplit(":", 1)
+    impairment = from_arguments(args)
+    s = socket(AF_INET, SOCK_DGRAM)
+    s.bind(("127.0.0.1", args.listen))
+    print(f"Forwarding port {args.listen} to {args.forward}")
+    log = open(args.log, "w") if args.log else None
+
+    try:
+        proxy(s, (host, int(port)), impairment, log)
+
+    except KeyboardInterrupt:
+        pass
+
+    s.close()
+
+    if log is not None:
+        log.close()
+
+    print(json.dumps(dict(impairment.counts)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Encode and decode time of each JPEG backend that loads here, on the
+same frames: BGR encode per chroma subsampling, then decode at full
+and reduced size into the backend's texture order.
+"""
+import argparse
+import os
+import sys
+from time import perf_counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "Client"))
+
+from decode_bench import synthetic  # noqa: E402
+from jpeg import BACKENDS, CV_SAMPLING, REDUCTIONS  # noqa: E402
+
+
+def timed(call, items, rounds):
+    """Seconds per item and the last result."""
+    start = perf_counter()
+
+    for _ in range(rounds):
+        for item in items:
+            result = call(item)
+
+    return (perf_counter() - start) / (rounds * len(items)), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=30)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--quality", type=int, default=60)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    frames = synthetic(args.frames, args.width, args.height)
+    print(f"{len(frames)} frames of {args.width}x{args.height}, "
+          f"quality {args.quality}")
+
+    for name, backend in BACKENDS.items():
+        try:
+            jpeg = backend()
+
+        except (OSError, RuntimeError) as error:
+            print(f"{name}: not available ({str(error).splitlines()[0]})")
+            continue
+
+        print(f"{name} ({jpeg.colorfmt}):")
+
+        for subsampling in CV_SAMPLING:
+            elapsed, _ = timed(
+                lambda image: jpeg.encode(image, args.quality, subsampling),
+                frames, args.rounds)
+            size = sum(
+                len(jpeg.encode(image, args.quality, subsampling))
+                for image in frames) // len(frames)
+            print(f"  encode {subsampling}: {elapsed * 1000:7.3f} ms/frame, "
+                  f"{size} bytes")
+
+        encoded = [jpeg.encode(image, args.quality) for image in frames]
+
+        for reduction in REDUCTIONS:
+            elapsed, image = timed(
+                lambda dat: jpeg.decode(dat, reduction),
+                encoded, args.rounds)
+            print(f"  decode 1/{reduction}: {elapsed * 1000:7.3f} ms/frame, "
+                  f"{image.shape[1]}x{image.shape[0]}")
+
+
+if __name__ == "__main__":
+    main()
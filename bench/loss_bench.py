@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Frame delivery ratio for different payload sizes and FEC settings
+under simulated independent packet loss. Datagrams bigger than the
+MTU are split by the kernel into IP fragments, and losing any
+fragment loses the whole datagram.
+"""
+import argparse
+import os
+import random
+import sys
+
+HERE = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(HERE, "..", "Server"))
+sys.path.insert(0, os.path.join(HERE, "..", "Client"))
+
+from protocol import HEADER_SIZE, MAX_IMAGE_DGRAM, PAYLOAD_SIZE  # noqa
+from segment import packetize  # noqa: E402
+from udpstream import Reassembler  # noqa: E402
+
+# IPv4 fragments carry at most 1480 bytes of a 1500 byte MTU.
+FRAGMENT = 1480
+
+
+def delivery_ratio(payload, fec, loss, frames, size, rng):
+    reassembler = Reassembler(deadline=1)
+    dat = os.urandom(size)
+    delivered = 0
+
+    for frame_id in range(frames):
+        for buffers in packetize(frame_id, dat, payload, fec):
+            datagram = b"".join(buffers)
+            fragments = -(-(len(datagram) + 8) // FRAGMENT)
+
+            if any(rng.random() < loss for _ in range(fragments)):
+                continue
+
+            frame = reassembler.push(datagram, now=frame_id)
+
+            if frame is not None:
+                reassembler.release(frame)
+                delivered += 1
+
+    return delivered / frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--size", type=int, default=60_000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    setups = (
+        (PAYLOAD_SIZE, None),
+        (8 * PAYLOAD_SIZE, None),
+        (MAX_IMAGE_DGRAM, None),
+        (PAYLOAD_SIZE, (10, 1)),
+        (PAYLOAD_SIZE, (10, 2)),
+        (PAYLOAD_SIZE, (20, 4)),
+    )
+    losses = (0.001, 0.005, 0.01, 0.02, 0.05)
+
+    print(f"{args.size} byte frames, header {HEADER_SIZE} bytes")
+    print("payload      fec" + "".join(f"{loss:>9.1%}" for loss in losses))
+
+    for payload, fec in setups:
+        ratios = [
+            delivery_ratio(
+                payload, fec, loss, args.frames, args.size,
+                random.Random(args.seed))
+            for loss in losses]
+        label = f"{fec[0]}+{fec[1]}" if fec else "-"
+        print(f"{payload:>7} {label:>8}"
+              + "".join(f"{r:>9.1%}" for r in ratios))
+
+
+if __name__ == "__main__":
+    main()
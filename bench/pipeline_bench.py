@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+End-to-end run of sender and receiver over loopback with synthetic
+frames and no window: throughput, frame delivery ratio and p50/p99
+time of each stage, from encode to the texture upload, saved as JSON
+to compare commits. Impairment options put impair.py's proxy between
+the two.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from socket import AF_INET, SOCK_DGRAM, socket
+from socket import timeout as TimeoutException
+from threading import Thread
+from time import perf_counter, sleep
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "Server"))
+sys.path.insert(0, os.path.join(HERE, "..", "Client"))
+
+import impair  # noqa: E402
+import jpeg  # noqa: E402
+from decode_bench import synthetic  # noqa: E402
+from decoder import DecodePool  # noqa: E402
+from protocol import MAX_DGRAM, PAYLOAD_SIZE  # noqa: E402
+from segment import FrameSegment, packetize  # noqa: E402
+from sockets import proc_drops, set_buffers  # noqa: E402
+from udpstream import Feed, Reassembler  # noqa: E402
+
+STAGES = (
+    "encode", "packetize", "send", "reassemble", "decode", "upload",
+    "end_to_end")
+
+
+class TimedDecodePool(DecodePool):
+    """
+    DecodePool noting how long each frame took to decode
+    """
+
+    def __init__(self, feed, timings, workers=2):
+        super().__init__(feed, workers)
+        self.timings = timings
+
+    def decode(self, frame):
+        start = perf_counter()
+        decoded = super().decode(frame)
+        self.timings["decode"][frame.frame_id] = perf_counter() - start
+        return decoded
+
+
+def send(segment, frames, fps, timings, started):
+    """Encode, packetize and send each frame, like Pipeline does."""
+    destination = (segment.addr, segment.port)
+    due = perf_counter()
+
+    for image in frames:
+        if fps:
+            delay = due - perf_counter()
+
+            if delay > 0:
+                sleep(delay)
+
+            due += 1 / fps
+
+        frame_id = segment.frame_id
+        start = started[frame_id] = perf_counter()
+        layers, captured = segment.encode(image)
+        dat, flags = layers[0]
+        encoded = perf_counter()
+        datagrams = list(packetize(
+            frame_id, dat, segment.payload, segment.fec, flags,
+            captured=captured))
+        packetized = perf_counter()
+
+        for buffers in datagrams:
+            segment.s.sendmsg(buffers, (), 0, destination)
+
+        sent = perf_counter()
+        timings["encode"][frame_id] = encoded - start
+        timings["packetize"][frame_id] = packetized - encoded
+        timings["send"][frame_id] = sent - packetized
+        segment.frame_id += 1
+        segment.bytes_sent += len(dat)
+
+
+def receive(sock, feed, timings, state):
+    """Reassemble datagrams into the feed, as FrameReceiver does."""
+    scratch = memoryview(bytearray(MAX_DGRAM))
+    pushing = 0.0
+
+    while state["receiving"]:
+        try:
+            size = sock.recv_into(scratch)
+
+        except TimeoutException:
+            continue
+
+        start = perf_counter()
+        completed = feed.reassembler.completed
+        feed.push(scratch[:size], None)
+        pushing += perf_counter() - start
+
+        if feed.reassembler.completed != completed:
+            # Every push since the last complete frame belongs to it.
+            timings["reassemble"][feed.reassembler.last_id] = pushing
+            pushing = 0.0
+
+
+def show(pool, timings, started, state, interval):
+    """Upload the newest decoded frame, as Stream.set_image does."""
+    texture = None
+
+    while state["showing"]:
+        frame = pool.take()
+
+        if frame is None:
+            sleep(interval)
+            continue
+
+        start = perf_counter()
+
+        if texture is None or texture.size != frame.pixels.size:
+            texture = np.empty_like(frame.pixels)
+
+        # What blit_buffer costs on the CPU side: one copy of the pixels.
+        np.copyto(texture, frame.pixels)
+        end = perf_counter()
+        timings["upload"][frame.frame_id] = end - start
+        timings["end_to_end"][frame.frame_id] = end - started[frame.frame_id]
+        state["shown"] += 1
+
+        if interval > 0.001:
+            sleep(interval)
+
+
+def summary(values):
+    values = np.array(list(values)) * 1000
+
+    if not len(values):
+        return None
+
+    return {
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p99": round(float(np.percentile(values, 99)), 3),
+        "mean": round(float(values.mean()), 3),
+        "count": len(values),
+    }
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+            capture_output=True, text=True, check=True).stdout.strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--quality", type=int, default=60)
+    parser.add_argument(
+        "--codec", default="mjpeg", choices=("mjpeg", "h264", "tiles"))
+    parser.add_argument(
+        "--fps", type=float, default=30, help="0 sends as fast as it can")
+    parser.add_argument(
+        "--display-fps", type=float, default=0,
+        help="how often the newest frame is shown, 0 polls every ms")
+    parser.add_argument("--payload", type=int, default=PAYLOAD_SIZE)
+    parser.add_argument("--fec", type=int, nargs=2, metavar=("N", "K"))
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument(
+        "--rcvbuf", type=int, default=0,
+        help="receiver's kernel buffer in bytes, 0 keeps the default")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument(
+        "--impair-log", help="impair.py's per datagram log to this file")
+    impair.add_arguments(parser)
+    args = parser.parse_args()
+
+    unique = synthetic(min(args.frames, 60), args.width, args.height)
+    frames = [unique[i % len(unique)] for i in range(args.frames)]
+    timings = {stage: {} for stage in STAGES}
+    started = {}
+    state = {"receiving": True, "showing": True, "shown": 0}
+
+    rx = socket(AF_INET, SOCK_DGRAM)
+    rx.bind(("127.0.0.1", 0))
+    rx.settimeout(0.1)
+    receive_buffer = set_buffers(rx, args.rcvbuf)[0]
+    feed = Feed(0, Reassembler(deadline=0.5))
+    pool = TimedDecodePool(feed, timings, args.workers)
+    pool.start()
+    impairment = impair.from_arguments(args)
+    target = rx.getsockname()
+    threads = [
+        Thread(target=receive, args=(rx, feed, timings, state)),
+        Thread(target=show, args=(
+            pool, timings, started, state,
+            1 / args.display_fps if args.display_fps else 0.001)),
+    ]
+
+    if impairment.active:
+        link = socket(AF_INET, SOCK_DGRAM)
+        link.bind(("127.0.0.1", 0))
+        log = open(args.impair_log, "w") if args.impair_log else None
+        threads.append(Thread(
+            target=impair.proxy, args=(link, target, impairment, log)))
+        target = link.getsockname()
+
+    tx = socket(AF_INET, SOCK_DGRAM)
+    segment = FrameSegment(
+        tx, target[1], "127.0.0.1", args.quality,
+        payload=args.payload, fec=tuple(args.fec) if args.fec else None,
+        codec=args.codec, framerate=int(args.fps) or 30)
+
+    for thread in threads:
+        thread.start()
+
+    start = perf_counter()
+    send(segment, frames, args.fps, timings, started)
+    elapsed = perf_counter() - start
+    # Let the last frames through before counting.
+    sleep(0.5 + impairment.delay + impairment.jitter)
+    state["receiving"] = state["showing"] = False
+    # Datagrams lost to a full receive buffer rather than the link.
+    kernel_drops = proc_drops(rx)
+
+    if impairment.active:
+        link.close()
+
+    for thread in threads:
+        thread.join()
+
+    pool.stop()
+    tx.close()
+    rx.close()
+
+    if impairment.active and log is not None:
+        log.close()
+
+    reassembler = feed.reassembler
+    results = {
+        "commit": commit(),
+        "config": {
+            **vars(args), "jpeg": jpeg.backend.name,
+            "receive_buffer": receive_buffer,
+            "bytes_per_frame":
+                segment.bytes_sent // max(segment.frame_id, 1)},
+        "frames": {
+            "sent": segment.frame_id,
+            "complete": reassembler.completed,
+            "decoded": pool.decoded,
+            "shown": state["shown"],
+            "delivery": round(state["shown"] / segment.frame_id, 4),
+            "complete_ratio": round(
+                reassembler.completed / segment.frame_id, 4),
+            "kernel_drops": kernel_drops,
+        },
+        "throughput": {
+            "sent_fps": round(segment.frame_id / elapsed, 2),
+            "shown_fps": round(state["shown"] / elapsed, 2),
+            "mbit_s": round(segment.bytes_sent * 8 / elapsed / 1e6, 2),
+        },
+        "impairment": dict(impairment.counts),
+        "latency_ms": {
+            stage: summary(timings[stage].values()) for stage in STAGES},
+    }
+
+    print(json.dumps(results, indent=2))
+
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Compare the receive throughput of the old `buffer += seg[1:]`
+reassembly with the pooled, preallocated one in Client/udpstream.py.
+"""
+import argparse
+import os
+import sys
+from time import perf_counter
+
+HERE = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(HERE, "..", "Server"))
+sys.path.insert(0, os.path.join(HERE, "..", "Client"))
+
+from protocol import MAX_IMAGE_DGRAM  # noqa: E402
+from segment import packetize  # noqa: E402
+from udpstream import Reassembler  # noqa: E402
+
+
+def concat_path(frames):
+    """The receive loop as it was, one byte countdown per datagram."""
+    for segments in frames:
+        buffer = b""
+
+        for seg in segments:
+            buffer += seg[1:]
+
+
+def pooled_path(frames):
+    reassembler = Reassembler()
+    scratch = memoryview(bytearray(2 ** 16))
+
+    for segments in frames:
+        for seg in segments:
+            # Stands in for sock.recv_into(scratch).
+            size = len(seg)
+            scratch[:size] = seg
+            frame = reassembler.push(scratch[:size])
+
+        reassembler.release(frame)
+
+
+def run(name, path, frames, size):
+    start = perf_counter()
+    path(frames)
+    elapsed = perf_counter() - start
+    rate = size * len(frames) / elapsed / 2 ** 20
+    print(f"{name:>8}: {rate:10.1f} MiB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--size", type=int, default=400_000)
+    parser.add_argument("--payload", type=int, default=MAX_IMAGE_DGRAM)
+    args = parser.parse_args()
+
+    dat = os.urandom(args.size)
+    frames = [
+        [b"".join(buffers)
+         for buffers in packetize(frame_id, dat, args.payload)]
+        for frame_id in range(args.frames)]
+
+    print(f"{args.frames} frames of {args.size} bytes, "
+          f"{len(frames[0])} segments each")
+    run("concat", concat_path, frames, args.size)
+    run("pooled", pooled_path, frames, args.size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# coding: utf-8
+"""
+XOR parity has to rebuild any one lost data segment of a group,
+whether the parity segment arrives before or after the others, and
+segments with an impossible header never reach the reassembler.
+"""
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "Client"))
+sys.path.append(os.path.join(HERE, "..", "Server"))
+
+from protocol import (FLAG_FEEDBACK, FLAG_PARITY, HEADER,  # noqa: E402
+                      HEADER_SIZE, VERSION, unpack_header)
+from segment import packetize  # noqa: E402
+from udpstream import Reassembler  # noqa: E402
+
+PAYLOAD = 1000
+FEC = (10, 1)
+# 26 data segments, the last one short, in groups of 10, 10 and 6.
+DATA = bytes(i * 7 % 251 for i in range(25 * PAYLOAD + 123))
+
+
+def datagrams(frame_id=1, fec=FEC):
+    """Data and parity datagrams of a frame in the order they are sent."""
+    return [
+        b"".join(bytes(buffer) for buffer in buffers)
+        for buffers in packetize(frame_id, DATA, PAYLOAD, fec)]
+
+
+def is_parity(datagram):
+    return bool(unpack_header(datagram)[0] & FLAG_PARITY)
+
+
+def reassemble(sequence):
+    reassembler = Reassembler()
+    frames = [reassembler.push(datagram, 0.0) for datagram in sequence]
+    frames = [frame for frame in frames if frame is not None]
+
+    assert len(frames) == 1
+    data = bytes(frames[0].data)
+    reassembler.release(frames[0])
+
+    return data, reassembler
+
+
+def without(sequence, index):
+    """The datagrams without the data segment of that index."""
+    return [
+        datagram for datagram in sequence
+        if is_parity(datagram) or unpack_header(datagram)[2] != index]
+
+
+@pytest.mark.parametrize("index", range(26))
+def test_parity_last_repairs_any_segment(index):
+    data, reassembler = reassemble(without(datagrams(), index))
+
+    assert data == DATA
+    assert reassembler.recovered == 1
+
+
+@pytest.mark.parametrize("index", range(26))
+def test_parity_first_repairs_any_segment(index):
+    sequence = without(datagrams(), index)
+    sequence.sort(key=lambda datagram: not is_parity(datagram))
+    data, reassembler = reassemble(sequence)
+
+    assert data == DATA
+    assert reassembler.recovered == 1
+
+
+def test_one_loss_per_group():
+    data, reassembler = reassemble(
+        without(without(without(datagrams(), 3), 14), 25))
+
+    assert data == DATA
+    assert reassembler.recovered == 1
+
+
+def test_two_losses_in_a_group_are_not_repaired():
+    reassembler = Reassembler()
+
+    for datagram in without(without(datagrams(), 3), 4):
+        assert reassembler.push(datagram, 0.0) is None
+
+
+def test_without_fec():
+    data, reassembler = reassemble(datagrams(fec=None))
+
+    assert data == DATA
+    assert reassembler.recovered == 0
+
+
+def forged(**fields):
+    """A valid data segment with some header fields replaced."""
+    values = dict(
+        version=VERSION, flags=0, stream=0,
+        frame_id=1, index=0, total=26, length=PAYLOAD, offset=0,
+        size=len(DATA), fec_n=10, fec_k=1, captured=0)
+    values.update(fields)
+    length = values["length"]
+
+    return HEADER.pack(*values.values()) + bytes(length)
+
+
+@pytest.mark.parametrize("datagram", [
+    pytest.param(bytes(HEADER_SIZE - 1), id="short"),
+    pytest.param(forged(version=0), id="version"),
+    pytest.param(forged(flags=FLAG_FEEDBACK), id="control"),
+    pytest.param(forged()[:-1], id="truncated"),
+    pytest.param(forged(size=1 << 30), id="oversized"),
+    pytest.param(forged(total=0), id="no segments"),
+    pytest.param(forged(index=26), id="index past total"),
+    pytest.param(forged(offset=len(DATA) - 10), id="outside of frame"),
+    pytest.param(forged(flags=FLAG_PARITY, index=3), id="parity index"),
+    pytest.param(
+        forged(flags=FLAG_PARITY, fec_n=0, fec_k=0), id="parity without fec"),
+])
+def test_malformed_header_is_rejected(datagram):
+    with pytest.raises(ValueError):
+        unpack_header(datagram)
+
+    reassembler = Reassembler()
+
+    with pytest.raises(ValueError):
+        reassembler.push(datagram, 0.0)
+
+    assert not reassembler.frames
+
+
+def test_well_formed_header_is_accepted():
+    assert unpack_header(forged())[1:4] == (1, 0, 26)
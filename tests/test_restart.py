@@ -0,0 +1,92 @@
+# coding: utf-8
+"""
+A sender that restarts counts its frame ids from 0 again, the
+receiver has to follow it instead of waiting for the old ids.
+"""
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "Client"))
+
+from decoder import DecodedFrame, DecodePool  # noqa: E402
+from protocol import FLAG_KEYFRAME, pack_header  # noqa: E402
+from udpstream import Feed, JitterBuffer, Reassembler  # noqa: E402
+
+
+def datagram(frame_id, captured=0.0):
+    """The only segment of a 100 byte frame."""
+    return pack_header(
+        frame_id, 0, 1, 100, 0, 100, FLAG_KEYFRAME,
+        captured=captured) + bytes(100)
+
+
+def run(reassembler, frame_ids, start=0.0, interval=0.03):
+    frames = []
+
+    for i, frame_id in enumerate(frame_ids):
+        frame = reassembler.push(datagram(frame_id), start + i * interval)
+
+        if frame is not None:
+            frames.append(frame)
+            reassembler.release(frame)
+
+    return frames
+
+
+def test_restart_far_behind():
+    reassembler = Reassembler(deadline=0.5)
+    run(reassembler, range(5000, 5010))
+    frames = run(reassembler, range(50), start=0.3)
+
+    assert [frame.frame_id for frame in frames] == list(range(50))
+    assert frames[0].restart and not frames[1].restart
+    assert reassembler.stale == 0
+    assert reassembler.restarts == 1
+
+
+def test_restart_close_behind_after_pause():
+    reassembler = Reassembler(deadline=0.5)
+    run(reassembler, range(10, 20))
+    frames = run(reassembler, range(5), start=2.0)
+
+    assert [frame.frame_id for frame in frames] == list(range(5))
+    assert frames[0].restart
+
+
+def test_late_segment_is_still_stale():
+    reassembler = Reassembler(deadline=0.5)
+    run(reassembler, range(10, 20))
+
+    assert run(reassembler, [15], start=0.3) == []
+    assert reassembler.stale == 1
+    assert reassembler.restarts == 0
+
+
+def test_decode_pool_publishes_after_restart():
+    pool = DecodePool(Feed(0, Reassembler()))
+    pool.publish(DecodedFrame(5000, (1, 1), b""))
+    pool.publish(DecodedFrame(0, (1, 1), b""), restart=True)
+    pool.publish(DecodedFrame(1, (1, 1), b""))
+
+    assert pool.decoded == 3
+    assert pool.take().frame_id == 1
+
+
+def test_jitter_buffer_releases_after_restart():
+    buffer = JitterBuffer()
+    reassembler = Reassembler(deadline=0.5)
+    old = run(reassembler, range(5000, 5003))
+
+    for frame in old:
+        buffer.put(frame)
+
+    assert buffer.take(now=10.0).frame_id == 5002
+
+    new = run(reassembler, range(3), start=20.0)
+
+    for frame in new:
+        buffer.put(frame)
+
+    assert buffer.take(now=30.0).frame_id == 2
+    assert buffer.late == 0